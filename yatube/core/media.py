@@ -0,0 +1,156 @@
+import mimetypes
+import os
+import re
+import stat
+import time
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+from sorl.thumbnail.conf import settings as thumbnail_settings
+
+from posts.storage import HASHED_NAME
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# Миниатюры sorl: cache/ab/cd/abcd…(md5 имени источника и опций).
+THUMBNAIL_NAME = re.compile(
+    re.escape(thumbnail_settings.THUMBNAIL_PREFIX)
+    + r'([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{28}\.\w+$'
+)
+
+
+class RangeFile:
+    """
+    Кусок открытого файла длиной length от текущей позиции.
+
+    fileno нарочно нет: не все wsgi.file_wrapper ограничивают sendfile
+    длиной ответа, поэтому куски отдаются чтением, а целые файлы —
+    без копирования.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """
+    (начало, конец) из заголовка Range для файла размером size.
+
+    None, если заголовка нет или диапазонов несколько: тогда отдаётся
+    весь файл. ValueError, если диапазон за пределами файла.
+    """
+    match = RANGE.match(header or '')
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        start = max(size - int(last), 0)
+        end = size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+def is_immutable(path):
+    """Имя выведено из содержимого: файл под ним никогда не меняется."""
+    return bool(HASHED_NAME.search(path) or THUMBNAIL_NAME.match(path))
+
+
+def _transfer(request, full_path, path, size, validators):
+    content_type = (
+        mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    )
+    if settings.MEDIA_SENDFILE == 'nginx':
+        # Range и условные запросы nginx обработает сам.
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = (
+            settings.MEDIA_ACCEL_PREFIX + quote(path)
+        )
+        return response
+    if settings.MEDIA_SENDFILE == 'sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+        return response
+    if_range = request.META.get('HTTP_IF_RANGE')
+    requested = None
+    if not if_range or if_range in validators:
+        try:
+            requested = parse_range(request.META.get('HTTP_RANGE'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+    if requested is None:
+        return FileResponse(open(full_path, 'rb'), content_type=content_type)
+    start, end = requested
+    file = open(full_path, 'rb')
+    file.seek(start)
+    response = FileResponse(
+        RangeFile(file, end - start + 1),
+        status=206,
+        content_type=content_type,
+    )
+    response['Content-Length'] = end - start + 1
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    Отдаёт файл из MEDIA_ROOT.
+
+    При MEDIA_SENDFILE передачу берёт на себя фронт-сервер
+    (X-Accel-Redirect для nginx, X-Sendfile для Apache и lighttpd),
+    иначе файл отдаёт FileResponse с поддержкой Range. Файлы, чьи
+    имена выведены из содержимого, кэшируются надолго; старые имена
+    и ответы с ошибкой — нет.
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        file_stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404(path)
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise Http404(path)
+    etag = f'"{file_stat.st_mtime_ns:x}-{file_stat.st_size:x}"'
+    last_modified = int(file_stat.st_mtime)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        response = _transfer(
+            request, full_path, path, file_stat.st_size,
+            (etag, http_date(last_modified)),
+        )
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    if response.status_code in (200, 206) and is_immutable(path):
+        patch_cache_control(
+            response, public=True, immutable=True,
+            max_age=settings.MEDIA_CACHE_MAX_AGE,
+        )
+        response['Expires'] = http_date(
+            time.time() + settings.MEDIA_CACHE_MAX_AGE
+        )
+    return response
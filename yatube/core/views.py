@@ -5,7 +5,7 @@ def page_not_found(request, exception):
     return render(request, 'core/404.html', {'path': request.path}, status=404)
 
 
-def csrf_failure(request, exception):
+def csrf_failure(request, exception=None, reason=''):
     return render(request, 'core/403csrf.html', status=403)
 
 
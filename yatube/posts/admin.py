@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Comment, Group, Post
+from .models import Comment, Group, Post, Tag
+from .search import matching_posts
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -21,7 +22,17 @@ class PostAdmin(admin.ModelAdmin):
     # Это свойство сработает для всех колонок: где пусто — там будет эта строка
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по тексту идёт через индекс, а не LIKE по всем постам
+        found = matching_posts(queryset, search_term)
+        if found is None:
+            return super().get_search_results(
+                request, queryset, search_term
+            )
+        return found, False
+
 
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group)
 admin.site.register(Comment)
+admin.site.register(Tag)
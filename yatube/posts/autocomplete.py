@@ -0,0 +1,173 @@
+import bisect
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.urls import reverse
+
+from .caching import surrogate_versions
+from .models import Group, User
+
+# Суррогатный ключ индекса: после его сброса каждый процесс
+# перестраивает индекс в фоне, отдавая пока старый.
+AUTOCOMPLETE_KEY = 'autocomplete'
+
+_lock = threading.Lock()
+_indexes = None
+_rebuild = None
+_last_rebuild = float('-inf')
+
+
+class PrefixIndex:
+    """
+    Отсортированный массив ключей и параллельный массив значений.
+
+    Начало диапазона с префиксом находит двоичный поиск, дальше
+    читается не больше limit соседних элементов.
+    """
+
+    def __init__(self, entries):
+        entries = sorted(entries)
+        # Оба массива подменяются одним присваиванием: поиск в другом
+        # потоке видит либо старую пару, либо новую.
+        self._arrays = (
+            [key for key, _ in entries], [value for _, value in entries]
+        )
+
+    def __len__(self):
+        return len(self._arrays[0])
+
+    def add(self, key, value):
+        """Вставка без перестройки: копия массивов, O(n) памяти."""
+        keys, values = self._arrays
+        position = bisect.bisect_right(keys, key)
+        self._arrays = (
+            keys[:position] + [key] + keys[position:],
+            values[:position] + [value] + values[position:],
+        )
+
+    def search(self, prefix, limit):
+        keys, values = self._arrays
+        found = []
+        position = bisect.bisect_left(keys, prefix)
+        while (
+            len(found) < limit and position < len(keys)
+            and keys[position].startswith(prefix)
+        ):
+            found.append(values[position])
+            position += 1
+        return found
+
+
+def build_indexes():
+    """Индексы имён пользователей и групп (по slug и по названию)."""
+    users = PrefixIndex(
+        (username.casefold(), username)
+        for username in User.objects.filter(is_active=True).values_list(
+            'username', flat=True
+        ).iterator()
+    )
+    groups = PrefixIndex(
+        (key.casefold(), (slug, title))
+        for slug, title in Group.objects.values_list('slug', 'title')
+        for key in (slug, title)
+    )
+    return users, groups
+
+
+def _is_stale(current, version):
+    if current is None or current[0] != version:
+        return True
+    max_age = settings.AUTOCOMPLETE_MAX_AGE
+    return max_age is not None and time.monotonic() - current[1] > max_age
+
+
+def _build():
+    global _indexes, _last_rebuild
+    _last_rebuild = time.monotonic()
+    version, = surrogate_versions(AUTOCOMPLETE_KEY)
+    _indexes = (version, time.monotonic(), *build_indexes())
+    return _indexes
+
+
+def _build_in_background():
+    global _rebuild
+    try:
+        _build()
+    finally:
+        connection.close()
+        with _lock:
+            _rebuild = None
+
+
+def indexes():
+    """
+    Индексы текущей версии. Строятся при первом запросе и заново
+    после сброса ключа AUTOCOMPLETE_KEY или по AUTOCOMPLETE_MAX_AGE;
+    запрос стоит одного чтения версии из кэша.
+
+    Перестройка идёт в фоновом потоке и не чаще, чем раз в
+    AUTOCOMPLETE_REBUILD_INTERVAL секунд, а запросы пока получают
+    старый индекс. При нулевом интервале индекс строится сразу.
+    """
+    global _rebuild
+    version, = surrogate_versions(AUTOCOMPLETE_KEY)
+    current = _indexes
+    if not _is_stale(current, version):
+        return current[2:]
+    interval = settings.AUTOCOMPLETE_REBUILD_INTERVAL
+    with _lock:
+        current = _indexes
+        if current is None or not interval:
+            if _is_stale(current, version):
+                current = _build()
+        elif _rebuild is None:
+            delay = max(0, _last_rebuild + interval - time.monotonic())
+            _rebuild = threading.Timer(delay, _build_in_background)
+            _rebuild.daemon = True
+            _rebuild.start()
+    return current[2:]
+
+
+def add_user(username):
+    """Добавляет нового пользователя в индекс этого процесса."""
+    with _lock:
+        if _indexes is not None:
+            _indexes[2].add(username.casefold(), username)
+
+
+def suggest(query, limit):
+    """
+    Не больше limit групп и пользователей, чьё имя начинается с query.
+
+    Группам достаётся не больше половины мест, если пользователей
+    хватает на остальные.
+    """
+    prefix = query.strip().casefold()
+    if not prefix:
+        return []
+    users, groups = indexes()
+    found_groups = list(dict.fromkeys(groups.search(prefix, limit * 2)))
+    found_users = users.search(prefix, limit)
+    found_groups = found_groups[
+        :max(limit - len(found_users), (limit + 1) // 2)
+    ]
+    found_users = found_users[:limit - len(found_groups)]
+    results = [
+        {
+            'type': 'group',
+            'label': title,
+            'url': reverse('posts:group_list', args=(slug,)),
+        }
+        for slug, title in found_groups
+    ]
+    results.extend(
+        {
+            'type': 'user',
+            'label': username,
+            'url': reverse('posts:profile', args=(username,)),
+        }
+        for username in found_users
+    )
+    return results
@@ -0,0 +1,364 @@
+import io
+import itertools
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.paginator import Paginator
+from django.template import Context, Template
+from django.template.loader import get_template
+from django.test import Client, override_settings
+from PIL import Image
+from sorl.thumbnail import default
+
+from .autocomplete import build_indexes, suggest
+from .feeds import backfill_follow, following_feed
+from .models import Follow, Group, Post, User
+from .paginators import CursorPaginator
+from .search import search_posts, trigram_search_ids
+from .thumbnails import (
+    cached_variants, generate_thumbnails, supported_formats,
+)
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Регистрирует сценарий для команды manage.py benchmark."""
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def measure(func, repeat):
+    """Медиана времени вызова func в миллисекундах."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def seed_users(count, prefix='bench'):
+    User.objects.bulk_create(
+        User(username=f'{prefix}_{number}') for number in range(count)
+    )
+    return list(User.objects.filter(username__startswith=f'{prefix}_'))
+
+
+def seed_posts(authors, total, **fields):
+    Post.objects.bulk_create(
+        Post(
+            text=f'Тестовый пост {number}',
+            author=authors[number % len(authors)],
+            **fields
+        )
+        for number in range(total)
+    )
+
+
+@benchmark('follow_feed')
+def follow_feed(stdout, size, repeat):
+    """Лента подписок: JOIN через Follow против материализованной ленты."""
+    authors = seed_users(200, prefix='bench_author')
+    reader = User.objects.create(username='bench_reader')
+    seed_posts(authors, size)
+    followed = authors[:100]
+    Follow.objects.bulk_create(
+        Follow(user=reader, author=author) for author in followed
+    )
+    for author in followed:
+        backfill_follow(reader.pk, author.pk)
+
+    def join():
+        list(Post.objects.select_related().filter(
+            author__following__user=reader
+        ).order_by('-pub_date', '-id')[:settings.POSTS_QUANTITY])
+
+    def timeline():
+        CursorPaginator(
+            following_feed(reader), settings.POSTS_QUANTITY
+        ).get_cursor_page()
+
+    stdout.write(f'JOIN Post-Follow:   {measure(join, repeat):.3f} мс')
+    stdout.write(f'Лента TimelineEntry: {measure(timeline, repeat):.3f} мс')
+
+
+# Прежний вариант paginator.html: ссылка на каждую страницу ленты.
+FULL_RANGE_TEMPLATE = Template(
+    '{% for i in page_obj.paginator.page_range %}'
+    '<li class="page-item"><a class="page-link" href="?page={{ i }}">'
+    '{{ i }}</a></li>'
+    '{% endfor %}'
+)
+
+
+@benchmark('paginator_render')
+def paginator_render(stdout, size, repeat):
+    """Время шаблона пагинатора: весь page_range против окна страниц."""
+    authors = seed_users(10)
+    template = get_template('posts/includes/paginator.html')
+    seeded = 0
+    for total in (size // 100, size // 10, size):
+        seed_posts(authors, total - seeded)
+        seeded = total
+        cache.clear()
+        posts = Post.objects.all()
+        middle = total // settings.POSTS_QUANTITY // 2 or 1
+
+        full_page = Paginator(posts, settings.POSTS_QUANTITY).page(middle)
+        cursor_page = CursorPaginator(
+            posts, settings.POSTS_QUANTITY
+        ).get_cursor_page(page=middle)
+
+        def full_range():
+            FULL_RANGE_TEMPLATE.render(Context({'page_obj': full_page}))
+
+        def windowed():
+            template.render({'page_obj': cursor_page})
+
+        stdout.write(
+            f'{total} постов: page_range {measure(full_range, repeat):.3f} '
+            f'мс, окно {measure(windowed, repeat):.3f} мс'
+        )
+
+
+@benchmark('conditional_get')
+def conditional_get(stdout, size, repeat):
+    """Полная отрисовка страниц против ответа 304 по ETag."""
+    authors = seed_users(10)
+    seed_posts(authors, size)
+    client = Client()
+    urls = ['/', f'/profile/{authors[0].username}/']
+    with override_settings(PAGE_CACHE_ENABLED=False):
+        for url in urls:
+            etag = client.get(url)['ETag']
+
+            def full():
+                client.get(url)
+
+            def not_modified():
+                client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+            stdout.write(
+                f'{url}: отрисовка {measure(full, repeat):.3f} мс, '
+                f'304 {measure(not_modified, repeat):.3f} мс'
+            )
+
+
+def sample_photo(number):
+    """JPEG 1600x1200 с плавными пятнами, сжимается как фотография."""
+    channels = [
+        Image.effect_noise((40, 30), 64 + number + shift).resize(
+            (1600, 1200), Image.BICUBIC
+        )
+        for shift in range(3)
+    ]
+    buffer = io.BytesIO()
+    Image.merge('RGB', channels).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+@benchmark('image_bytes')
+def image_bytes(stdout, size, repeat):
+    """Байты картинок на странице ленты: JPEG 960x339 против вариантов."""
+    media_root = tempfile.mkdtemp()
+    try:
+        with override_settings(MEDIA_ROOT=media_root):
+            author = seed_users(1)[0]
+            totals = {}
+            for number in range(settings.POSTS_QUANTITY):
+                post = Post.objects.create(
+                    text=f'Пост с картинкой {number}',
+                    author=author,
+                    image=SimpleUploadedFile(
+                        f'bench_{number}.jpg', sample_photo(number)
+                    ),
+                )
+                generate_thumbnails(post.image.name)
+                for image_format, files in cached_variants(
+                    post.image, 'card'
+                ).items():
+                    for width, thumbnail in files:
+                        totals[image_format, width] = totals.get(
+                            (image_format, width), 0
+                        ) + default.storage.size(thumbnail.name)
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+    # Раньше любой клиент получал JPEG 960x339 — это вариант JPEG 960.
+    before = totals['JPEG', 960]
+    stdout.write(f'До: JPEG 960 для всех — {before // 1024} КиБ на страницу')
+    for (image_format, width), total in sorted(totals.items()):
+        stdout.write(
+            f'{image_format} {width}w: {total // 1024} КиБ '
+            f'({total / before:.0%})'
+        )
+    skipped = set(settings.POST_THUMBNAIL_FORMATS) - set(supported_formats())
+    if skipped:
+        stdout.write(f'Pillow не умеет писать: {", ".join(sorted(skipped))}')
+
+
+# Слова синтетических постов одной длины, чтобы поиск по началу
+# последнего слова не задевал соседние; частоты убывают по Ципфу.
+SEARCH_WORDS = [f'слово{number:04d}' for number in range(5000)]
+
+
+def seed_texts(authors, total, batch=10000):
+    """Посты из случайных слов SEARCH_WORDS, пачками по batch."""
+    rng = random.Random(0)
+    weights = list(itertools.accumulate(
+        1 / rank for rank in range(1, len(SEARCH_WORDS) + 1)
+    ))
+    for first in range(0, total, batch):
+        Post.objects.bulk_create(
+            Post(
+                text=' '.join(rng.choices(
+                    SEARCH_WORDS, cum_weights=weights, k=12
+                )),
+                author=authors[number % len(authors)],
+            )
+            for number in range(first, min(first + batch, total))
+        )
+
+
+@benchmark('post_html')
+def post_html(stdout, size, repeat):
+    """Шаблон страницы ленты: фильтры текста против готового HTML."""
+    authors = seed_users(10)
+    rng = random.Random(0)
+    # bulk_create обходит Post.save(), так что text_html пока пуст.
+    Post.objects.bulk_create(
+        Post(
+            text='\n'.join(
+                ' '.join(rng.choices(SEARCH_WORDS, k=12)) for _ in range(20)
+            ),
+            author=authors[number % len(authors)],
+        )
+        for number in range(size)
+    )
+    template = Template(
+        "{% for post in page_obj %}"
+        "{% include 'includes/post_card.html' %}{% endfor %}"
+    )
+    posts = Post.objects.select_related('author', 'group')
+    for label in ('фильтры', 'готовый HTML'):
+        if label == 'готовый HTML':
+            call_command(
+                'backfill_post_html', '--workers=1', stdout=io.StringIO()
+            )
+        page = list(posts[:settings.POSTS_QUANTITY])
+
+        def render():
+            template.render(Context({'page_obj': page}))
+
+        stdout.write(
+            f'{label}: страница {measure(render, repeat):.3f} мс'
+        )
+
+
+@benchmark('search')
+def search(stdout, size, repeat):
+    """Поиск по тексту: LIKE '%слово%' против индекса FTS5."""
+    authors = seed_users(10)
+    seed_texts(authors, size)
+    posts = Post.objects.select_related('author', 'group')
+    for word in (SEARCH_WORDS[0], SEARCH_WORDS[100], SEARCH_WORDS[-1]):
+        matches = Post.objects.filter(text__contains=word).count()
+
+        def like():
+            list(posts.filter(text__icontains=word)[
+                :settings.POSTS_QUANTITY
+            ])
+
+        def fts():
+            list(search_posts(posts, word, settings.POSTS_QUANTITY))
+
+        stdout.write(
+            f'{word} ({matches} постов): LIKE {measure(like, repeat):.3f} '
+            f'мс, FTS5 {measure(fts, repeat):.3f} мс'
+        )
+
+
+@benchmark('trigram_search')
+def trigram_search(stdout, size, repeat):
+    """Поиск подстроки: LIKE '%слово%' против триграммного индекса."""
+    authors = seed_users(10)
+    seed_texts(authors, size)
+    call_command('build_trigram_index', stdout=io.StringIO())
+    for word in (SEARCH_WORDS[0], SEARCH_WORDS[100], SEARCH_WORDS[-1]):
+        matches = Post.objects.filter(text__contains=word).count()
+
+        def like():
+            list(Post.objects.filter(text__contains=word).order_by(
+                '-pk'
+            ).values_list('pk', flat=True)[:settings.SEARCH_RANK_LIMIT])
+
+        def trigram():
+            trigram_search_ids(word)
+
+        stdout.write(
+            f'{word} ({matches} постов): LIKE {measure(like, repeat):.3f} '
+            f'мс, триграммы {measure(trigram, repeat):.3f} мс'
+        )
+
+
+def percentile_99(func, calls):
+    """99-й перцентиль времени вызовов func(arg) в миллисекундах."""
+    timings = []
+    for arg in calls:
+        start = time.perf_counter()
+        func(arg)
+        timings.append(time.perf_counter() - start)
+    return statistics.quantiles(timings, n=100)[98] * 1000
+
+
+@benchmark('autocomplete')
+def autocomplete(stdout, size, repeat):
+    """Подсказки по началу имени: istartswith против индекса в памяти."""
+    rng = random.Random(0)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    for first in range(0, size, 10000):
+        User.objects.bulk_create(
+            User(username=''.join(rng.choices(letters, k=8)) + str(number))
+            for number in range(first, min(first + 10000, size))
+        )
+    Group.objects.bulk_create(
+        Group(title=f'Группа {number}', slug=f'group-{number}')
+        for number in range(1000)
+    )
+    start = time.perf_counter()
+    build_indexes()
+    stdout.write(
+        f'Построение индекса: {(time.perf_counter() - start) * 1000:.0f} мс'
+    )
+    prefixes = [
+        ''.join(rng.choices(letters, k=rng.randint(1, 3)))
+        for _ in range(repeat * 100)
+    ]
+    limit = settings.AUTOCOMPLETE_LIMIT
+
+    def like(prefix):
+        list(User.objects.filter(username__istartswith=prefix).values_list(
+            'username', flat=True
+        )[:limit])
+        list(Group.objects.filter(slug__istartswith=prefix).values_list(
+            'slug', 'title'
+        )[:limit])
+
+    def indexed(prefix):
+        suggest(prefix, limit)
+
+    indexed('a')
+    stdout.write(
+        f'{size} пользователей, p99: istartswith '
+        f'{percentile_99(like, prefixes[:repeat * 10]):.3f} мс, '
+        f'индекс {percentile_99(indexed, prefixes):.3f} мс'
+    )
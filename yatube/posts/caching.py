@@ -0,0 +1,230 @@
+import hashlib
+import time
+from datetime import datetime
+from functools import wraps
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .tags import hashtags
+
+VERSION_KEY = 'surrogate:version:{}'
+CURSOR_PARAMS = ('after', 'before', 'page')
+PAGE_KEY = 'pagecache:{}'
+PAGE_STATS_KEY = 'pagecache:stats:{}'
+MARKS_KEY = 'conditional:marks:{}'
+
+
+def _initial_version():
+    # Счётчик, вытесненный из кэша, начинается не с единицы, чтобы
+    # новая версия не совпала с версией старых записей.
+    return int(time.time() * 1000)
+
+
+def surrogate_versions(*keys):
+    """Текущие версии суррогатных ключей одним запросом к кэшу."""
+    cache_keys = [VERSION_KEY.format(key) for key in keys]
+    versions = cache.get_many(cache_keys)
+    missing = {
+        key: _initial_version() for key in cache_keys if key not in versions
+    }
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in cache_keys]
+
+
+def purge_surrogate_keys(*keys):
+    """
+    Делает устаревшими все фрагменты и страницы с этими ключами.
+
+    Версия ключа — время последнего сброса в миллисекундах, поэтому
+    она же служит Last-Modified страницы.
+    """
+    cache_keys = [VERSION_KEY.format(key) for key in keys]
+    current = cache.get_many(cache_keys)
+    now = _initial_version()
+    cache.set_many(
+        {key: max(now, current.get(key, 0) + 1) for key in cache_keys},
+        None,
+    )
+
+
+def surrogate_key(kind, value):
+    """Ключ вида group:slug; значение экранируется, ключи идут через пробел."""
+    return f'{kind}:{quote(str(value), safe="")}'
+
+
+def post_surrogate_keys(post):
+    keys = [
+        'posts',
+        surrogate_key('post', post.pk),
+        surrogate_key('author', post.author.username),
+    ]
+    if post.group_id:
+        keys.append(surrogate_key('group', post.group.slug))
+    keys.extend(surrogate_key('tag', name) for name in hashtags(post.text))
+    return keys
+
+
+def feed_cache_key(request, *keys):
+    """Ключ фрагмента ленты: суррогатные ключи, их версии и курсор."""
+    cursor = '&'.join(
+        f'{param}={request.GET[param]}'
+        for param in CURSOR_PARAMS if param in request.GET
+    )
+    versions = map(str, surrogate_versions(*keys))
+    return ':'.join([*keys, *versions, cursor])
+
+
+def add_surrogate_keys(response, *keys):
+    """Помечает ответ ключами, по которым его можно сбросить из кэша."""
+    existing = response.get('Surrogate-Key', '').split()
+    response['Surrogate-Key'] = ' '.join([*existing, *keys])
+    return response
+
+
+def increment(key):
+    """Увеличивает счётчик-метрику в кэше."""
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def page_cache_stats():
+    hits, misses = (
+        cache.get(PAGE_STATS_KEY.format(outcome), 0)
+        for outcome in ('hits', 'misses')
+    )
+    return hits, misses
+
+
+def reset_page_cache_stats():
+    cache.delete_many(
+        [PAGE_STATS_KEY.format(outcome) for outcome in ('hits', 'misses')]
+    )
+
+
+def cache_anonymous_page(view):
+    """
+    Кэширует всю страницу для анонимных GET-запросов.
+
+    Запись живёт, пока не изменилась версия ни одного из ключей из
+    заголовка Surrogate-Key ответа. Заголовок запроса
+    Cache-Control: no-cache заставляет отрисовать страницу заново.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if (
+            not settings.PAGE_CACHE_ENABLED
+            or request.method != 'GET'
+            or request.user.is_authenticated
+        ):
+            return view(request, *args, **kwargs)
+        path = request.get_full_path().encode()
+        cache_key = PAGE_KEY.format(hashlib.md5(path).hexdigest())
+        if 'no-cache' not in request.META.get('HTTP_CACHE_CONTROL', ''):
+            entry = cache.get(cache_key)
+            if entry is not None:
+                keys, versions, content_type, content = entry
+                if surrogate_versions(*keys) == versions:
+                    increment(PAGE_STATS_KEY.format('hits'))
+                    response = HttpResponse(
+                        content, content_type=content_type
+                    )
+                    response['X-Cache'] = 'HIT'
+                    return add_surrogate_keys(response, *keys)
+        increment(PAGE_STATS_KEY.format('misses'))
+        response = view(request, *args, **kwargs)
+        keys = response.get('Surrogate-Key', '').split()
+        if (
+            response.status_code == 200
+            and keys
+            and not response.streaming
+            and not response.cookies
+        ):
+            cache.set(
+                cache_key,
+                (
+                    keys,
+                    surrogate_versions(*keys),
+                    response['Content-Type'],
+                    response.content,
+                ),
+                settings.PAGE_CACHE_TIMEOUT,
+            )
+        response['X-Cache'] = 'MISS'
+        return response
+    return wrapper
+
+
+def conditional_page(validators):
+    """
+    Отвечает 304 Not Modified, если у клиента актуальная копия.
+
+    validators(request, *args, **kwargs) возвращает суррогатные ключи
+    страницы и кортеж отметок, например (pub_date, id) свежего поста,
+    или None, если страницы нет. Вместо кортежа можно вернуть функцию
+    без аргументов: её результат кэшируется, пока не сменилась версия
+    ключей, и тогда 304 обходится чтением кэша без запросов к базе.
+    Функция возвращает None, если страницы нет.
+
+    В ETag входит и CSRF-cookie: страница с формой, сохранённая до
+    повторного входа, несёт старый токен и должна прийти заново.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            found = None
+            if request.method in ('GET', 'HEAD'):
+                found = validators(request, *args, **kwargs)
+            if found is None:
+                return view(request, *args, **kwargs)
+            keys, marks = found
+            versions = surrogate_versions(*keys)
+            if callable(marks):
+                marks_key = MARKS_KEY.format(hashlib.md5(repr((
+                    view.__module__, view.__name__, args, kwargs,
+                    request.user.pk, keys, versions,
+                )).encode()).hexdigest())
+                cached = cache.get(marks_key)
+                if cached is None:
+                    cached = (marks(),)
+                    cache.set(
+                        marks_key, cached, settings.PAGE_CACHE_TIMEOUT
+                    )
+                marks, = cached
+                if marks is None:
+                    return view(request, *args, **kwargs)
+            marks = marks or ()
+            raw = repr((
+                request.get_full_path(), request.user.pk,
+                request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+                keys, versions, marks,
+            ))
+            etag = quote_etag(hashlib.md5(raw.encode()).hexdigest())
+            last_modified = max(
+                [
+                    mark.timestamp() for mark in marks
+                    if isinstance(mark, datetime)
+                ] + [version / 1000 for version in versions]
+            )
+            response = get_conditional_response(
+                request, etag=etag, last_modified=int(last_modified)
+            )
+            if response is None:
+                response = view(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                response.setdefault('ETag', etag)
+                response.setdefault(
+                    'Last-Modified', http_date(last_modified)
+                )
+            return response
+        return wrapper
+    return decorator
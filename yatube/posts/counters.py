@@ -0,0 +1,112 @@
+from django.db.models import Count, F
+
+from .models import Comment, Follow, Post, User, UserStats
+
+USER_COUNTERS = ('posts_count', 'followers_count', 'following_count')
+
+
+def actual_user_counters(user_id):
+    return {
+        'posts_count': Post.objects.filter(author_id=user_id).count(),
+        'followers_count': Follow.objects.filter(author_id=user_id).count(),
+        'following_count': Follow.objects.filter(user_id=user_id).count(),
+    }
+
+
+def _create_stats(user_id):
+    stats, _ = UserStats.objects.get_or_create(
+        user_id=user_id, defaults=actual_user_counters(user_id)
+    )
+    return stats
+
+
+def bump_user(user_id, **deltas):
+    """Атомарно сдвигает счётчики пользователя через F()."""
+    updated = UserStats.objects.filter(user_id=user_id).update(
+        **{name: F(name) + delta for name, delta in deltas.items()}
+    )
+    if not updated and all(delta > 0 for delta in deltas.values()):
+        # Строки ещё нет: считаем честно, изменение уже в базе.
+        # При удалениях строку не создаём, иначе каскадное удаление
+        # пользователя оставило бы её без владельца.
+        _create_stats(user_id)
+
+
+def bump_comments(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=F('comments_count') + delta
+    )
+
+
+def stats_for(user):
+    """Счётчики пользователя; строка создаётся при первом обращении."""
+    try:
+        return user.stats
+    except UserStats.DoesNotExist:
+        user.stats = _create_stats(user.pk)
+        return user.stats
+
+
+def _grouped(queryset, field):
+    return dict(
+        queryset.values(field).annotate(total=Count('id')).values_list(
+            field, 'total'
+        )
+    )
+
+
+def repair_users(first_id, last_id, dry_run=False):
+    """Сверяет счётчики пользователей с pk в [first_id, last_id]."""
+    actual = {
+        'posts_count': _grouped(Post.objects.filter(
+            author__gte=first_id, author__lte=last_id), 'author'),
+        'followers_count': _grouped(Follow.objects.filter(
+            author__gte=first_id, author__lte=last_id), 'author'),
+        'following_count': _grouped(Follow.objects.filter(
+            user__gte=first_id, user__lte=last_id), 'user'),
+    }
+    stored = UserStats.objects.in_bulk(
+        UserStats.objects.filter(
+            user__gte=first_id, user__lte=last_id
+        ).values_list('user_id', flat=True)
+    )
+    user_ids = User.objects.filter(
+        pk__range=(first_id, last_id)
+    ).values_list('pk', flat=True)
+    drifted = 0
+    missing = []
+    for user_id in user_ids:
+        expected = {
+            name: actual[name].get(user_id, 0) for name in USER_COUNTERS
+        }
+        stats = stored.get(user_id)
+        if stats is None:
+            missing.append(UserStats(user_id=user_id, **expected))
+        elif any(
+            getattr(stats, name) != value for name, value in expected.items()
+        ):
+            drifted += 1
+            if not dry_run:
+                UserStats.objects.filter(user_id=user_id).update(**expected)
+    if missing and not dry_run:
+        UserStats.objects.bulk_create(missing, ignore_conflicts=True)
+    return drifted + len(missing)
+
+
+def repair_posts(first_id, last_id, dry_run=False):
+    """Сверяет comments_count постов с pk в [first_id, last_id]."""
+    actual = _grouped(
+        Comment.objects.filter(post__gte=first_id, post__lte=last_id), 'post'
+    )
+    posts = Post.objects.filter(
+        pk__range=(first_id, last_id)
+    ).values_list('pk', 'comments_count')
+    drifted = 0
+    for post_id, stored in posts:
+        expected = actual.get(post_id, 0)
+        if stored == expected:
+            continue
+        drifted += 1
+        if not dry_run:
+            Post.objects.filter(pk=post_id).update(comments_count=expected)
+    return drifted
@@ -0,0 +1,287 @@
+import heapq
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Follow, Post, TimelineEntry, UserStats
+from .paginators import QuerySetSource, post_key
+
+FAN_OUT_BATCH_SIZE = 1000
+RECENT_POSTS_LIMIT = 200
+RECENT_POSTS_KEY = 'feeds:recent:{}'
+# Списки сбрасываются сигналами поста; срок страхует от пропущенного
+# сброса (массовые update и delete сигналов не шлют).
+RECENT_POSTS_TTL = 60
+PULLED_AUTHORS_KEY = 'feeds:pulled_authors'
+PULLED_AUTHORS_TTL = 60
+
+
+def pulled_author_ids():
+    """
+    Авторы, чьи посты не раскладываются по лентам, а дочитываются
+    при показе. Кэш сбрасывается при каждой смене флага pulled.
+    """
+    author_ids = cache.get(PULLED_AUTHORS_KEY)
+    if author_ids is None:
+        author_ids = set(
+            UserStats.objects.filter(pulled=True).values_list(
+                'user_id', flat=True
+            )
+        )
+        cache.set(PULLED_AUTHORS_KEY, author_ids, PULLED_AUTHORS_TTL)
+    return author_ids
+
+
+def is_pulled(author_id):
+    # Запись в ленты сверяется с базой, а не с кэшем: пост, не
+    # разложенный по устаревшему кэшу, пропал бы из лент навсегда.
+    return UserStats.objects.filter(user_id=author_id, pulled=True).exists()
+
+
+def mark_pulled(author_id):
+    """Переводит автора на дочитывание, если подписчиков больше порога."""
+    if UserStats.objects.filter(
+        user_id=author_id,
+        pulled=False,
+        followers_count__gt=settings.FEED_FAN_OUT_THRESHOLD,
+    ).update(pulled=True):
+        cache.delete(PULLED_AUTHORS_KEY)
+
+
+def _insert_in_batches(entries):
+    """Пишет записи ленты пачками, не держа их все в памяти."""
+    batch = []
+    inserted = 0
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= FAN_OUT_BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+        inserted += len(batch)
+    return inserted
+
+
+def fan_out_post(post):
+    """Раскладывает новый пост в ленты всех подписчиков автора."""
+    if is_pulled(post.author_id):
+        return 0
+    followers = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    return _insert_in_batches(
+        TimelineEntry(
+            user_id=user_id,
+            post_id=post.pk,
+            author_id=post.author_id,
+            pub_date=post.pub_date,
+        )
+        for user_id in followers.iterator()
+    )
+
+
+def _backfill_posts(author_id):
+    """Последние FEED_BACKFILL_POSTS постов автора: (id, pub_date)."""
+    return list(
+        Post.objects.filter(author_id=author_id).order_by(
+            '-pub_date', '-id'
+        ).values_list('pk', 'pub_date')[:settings.FEED_BACKFILL_POSTS]
+    )
+
+
+def backfill_follow(user_id, author_id):
+    """Добавляет в ленту подписчика последние посты автора."""
+    if is_pulled(author_id):
+        return 0
+    return _insert_in_batches(
+        TimelineEntry(
+            user_id=user_id,
+            post_id=post_id,
+            author_id=author_id,
+            pub_date=pub_date,
+        )
+        for post_id, pub_date in _backfill_posts(author_id)
+    )
+
+
+def release_pulled_author(author_id):
+    """
+    Возвращает автора к раскладке при публикации и раскладывает его
+    последние посты всем подписчикам.
+
+    Флаг снимается до раскладки: новые посты с этого момента уже
+    раскладываются сами, повторы отсекает уникальный индекс.
+    """
+    if not UserStats.objects.filter(
+        user_id=author_id, pulled=True
+    ).update(pulled=False):
+        return 0
+    cache.delete(PULLED_AUTHORS_KEY)
+    posts = _backfill_posts(author_id)
+    followers = Follow.objects.filter(
+        author_id=author_id
+    ).values_list('user_id', flat=True)
+    return _insert_in_batches(
+        TimelineEntry(
+            user_id=user_id,
+            post_id=post_id,
+            author_id=author_id,
+            pub_date=pub_date,
+        )
+        for user_id in followers.iterator()
+        for post_id, pub_date in posts
+    )
+
+
+def drop_follow(user_id, author_id):
+    """Убирает посты автора из ленты отписавшегося пользователя."""
+    TimelineEntry.objects.filter(
+        user_id=user_id, author_id=author_id
+    ).delete()
+
+
+def forget_recent_posts(author_id):
+    cache.delete(RECENT_POSTS_KEY.format(author_id))
+
+
+RECENT_POSTS_SQL = '''
+    SELECT id, author_id, pub_date FROM (
+        SELECT id, author_id, pub_date, ROW_NUMBER() OVER (
+            PARTITION BY author_id ORDER BY pub_date DESC, id DESC
+        ) AS position
+        FROM {table} WHERE author_id IN ({placeholders})
+    ) AS recent
+    WHERE position <= %s
+'''
+
+
+def _fetch_recent_posts(author_ids):
+    """Последние посты всех авторов одним запросом, по окну на автора."""
+    sql = RECENT_POSTS_SQL.format(
+        table=Post._meta.db_table,
+        placeholders=', '.join(['%s'] * len(author_ids)),
+    )
+    result = {author_id: [] for author_id in author_ids}
+    for post in Post.objects.raw(
+        sql, [*author_ids, RECENT_POSTS_LIMIT]
+    ):
+        result[post.author_id].append((post.pub_date, post.pk))
+    for keys in result.values():
+        keys.sort(reverse=True)
+    return result
+
+
+def recent_post_keys(author_ids):
+    """Ключи (pub_date, id) последних постов каждого автора, из кэша."""
+    keys = {
+        author_id: RECENT_POSTS_KEY.format(author_id)
+        for author_id in author_ids
+    }
+    cached = cache.get_many(keys.values())
+    result = {
+        author_id: cached[key]
+        for author_id, key in keys.items() if key in cached
+    }
+    missing_ids = [
+        author_id for author_id in keys if author_id not in result
+    ]
+    if missing_ids:
+        fetched = _fetch_recent_posts(missing_ids)
+        result.update(fetched)
+        cache.set_many(
+            {
+                keys[author_id]: post_keys
+                for author_id, post_keys in fetched.items()
+            },
+            RECENT_POSTS_TTL,
+        )
+    return result
+
+
+class TimelineSource(QuerySetSource):
+    """Разложенная лента подписок: диапазонное чтение по индексу."""
+
+    def __init__(self, user):
+        super().__init__(
+            user.timeline.select_related('post__author', 'post__group'),
+            id_field='post_id',
+        )
+
+    def to_post(self, entry):
+        return entry.post
+
+
+class PulledAuthorsSource:
+    """
+    Посты авторов, которые дочитываются при показе ленты.
+
+    Последние посты каждого автора лежат в кэше, страница собирается
+    ограниченным k-way слиянием этих списков и одним запросом постов.
+    """
+
+    def __init__(self, author_ids):
+        self.author_ids = list(author_ids)
+
+    def count(self):
+        return QuerySetSource(
+            Post.objects.filter(author_id__in=self.author_ids)
+        ).count()
+
+    def latest_key(self):
+        latest = [
+            keys[0] for keys in recent_post_keys(self.author_ids).values()
+            if keys
+        ]
+        return max(latest, default=None)
+
+    def _window(self, author_id, keys, cursor, reverse, wanted):
+        if cursor is None:
+            window = keys[::-1] if reverse else keys
+        elif reverse:
+            window = [key for key in reversed(keys) if key > cursor]
+        else:
+            window = [key for key in keys if key < cursor]
+        # Кэш хранит только хвост ленты автора: если его не хватило,
+        # дочитываем этого автора из базы.
+        complete = len(keys) < RECENT_POSTS_LIMIT or (
+            cursor is not None and reverse and cursor >= keys[-1]
+        ) or (not reverse and len(window) >= wanted)
+        if not complete:
+            source = QuerySetSource(
+                Post.objects.filter(author_id=author_id).only('pub_date')
+            )
+            window = [
+                post_key(post)
+                for post in source.rows(cursor, reverse, 0, wanted)
+            ]
+        return window[:wanted]
+
+    def rows(self, cursor=None, reverse=False, offset=0, limit=None):
+        wanted = offset + limit
+        recent = recent_post_keys(self.author_ids)
+        windows = [
+            self._window(author_id, keys, cursor, reverse, wanted)
+            for author_id, keys in recent.items()
+        ]
+        keys = list(
+            heapq.merge(*windows, reverse=not reverse)
+        )[offset:offset + limit]
+        posts = Post.objects.select_related('author', 'group').in_bulk(
+            [pk for _, pk in keys]
+        )
+        return [posts[pk] for _, pk in keys if pk in posts]
+
+
+def following_feed(user):
+    """Источники ленты подписок: разложенная лента и дочитываемые авторы."""
+    sources = [TimelineSource(user)]
+    pulled = pulled_author_ids()
+    if pulled:
+        author_ids = user.follower.filter(
+            author_id__in=pulled
+        ).values_list('author_id', flat=True)
+        if author_ids:
+            sources.append(PulledAuthorsSource(author_ids))
+    return sources
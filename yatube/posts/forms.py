@@ -1,6 +1,7 @@
 from django import forms
 
 from .models import Comment, Post
+from .uploads import image_metadata
 
 
 class PostForm(forms.ModelForm):
@@ -15,6 +16,27 @@ class PostForm(forms.ModelForm):
             'group': 'Группа, к которой будет относиться пост'
         }
 
+    def __init__(self, *args, upload_errors=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_errors = upload_errors or {}
+
+    def clean(self):
+        # Файлы, отброшенные BoundedImageUploadHandler, не доходят до
+        # формы, поэтому причину отказа добавляем сами.
+        for field, error in self.upload_errors.items():
+            self.add_error(field, error)
+        return super().clean()
+
+    def save(self, commit=True):
+        if 'image' in self.changed_data:
+            # Заглушку посчитает пул миниатюр: декодировать картинку
+            # в запросе слишком дорого.
+            for field, value in image_metadata(
+                self.cleaned_data['image'], with_placeholder=False
+            ).items():
+                setattr(self.instance, field, value)
+        return super().save(commit)
+
 
 class CommentForm(forms.ModelForm):
 
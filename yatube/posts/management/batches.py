@@ -0,0 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections
+from django.db.models import Max
+
+
+def pk_chunks(model, chunk_size):
+    """Диапазоны (first_id, last_id) по chunk_size ключей до max(pk)."""
+    last_id = model.objects.aggregate(last=Max('pk'))['last'] or 0
+    for first_id in range(1, last_id + 1, chunk_size):
+        yield first_id, min(first_id + chunk_size - 1, last_id)
+
+
+def _run_in_thread(task):
+    function, *args = task
+    try:
+        return function(*args)
+    finally:
+        connections.close_all()
+
+
+def run_tasks(tasks, workers):
+    """
+    Выполняет задачи (функция, *аргументы) и возвращает результаты
+    в том же порядке.
+
+    При workers > 1 задачи идут в пуле потоков, и каждый поток
+    закрывает свои соединения с базой.
+    """
+    if workers > 1:
+        with ThreadPoolExecutor(workers) as executor:
+            return list(executor.map(_run_in_thread, tasks))
+    return [function(*args) for function, *args in tasks]
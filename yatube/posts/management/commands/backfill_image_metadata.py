@@ -0,0 +1,66 @@
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from PIL import Image
+
+from posts.management.batches import pk_chunks, run_tasks
+from posts.models import Post
+from posts.uploads import image_metadata
+
+FIELDS = ('width', 'height', 'format', 'bytes', 'placeholder')
+
+
+def backfill(first_id, last_id):
+    """
+    Заполняет метаданные картинок постов first_id..last_id.
+
+    Возвращает (заполнено, файлов не найдено).
+    """
+    posts = Post.objects.filter(
+        Q(width__isnull=True) | Q(placeholder=''),
+        pk__range=(first_id, last_id),
+    ).exclude(image='').only('pk', 'image')
+    filled, missing = [], 0
+    for post in posts:
+        try:
+            metadata = image_metadata(post.image)
+        except (
+            OSError, ValueError, SuspiciousFileOperation,
+            Image.DecompressionBombError,
+        ):
+            missing += 1
+            continue
+        for field, value in metadata.items():
+            setattr(post, field, value)
+        filled.append(post)
+    Post.objects.bulk_update(filled, FIELDS)
+    return len(filled), missing
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет ширину, высоту, формат, размер и заглушку картинок '
+        'у постов, загруженных до появления этих полей.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Сколько пачек обрабатывать параллельно.',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Сколько постов в одной пачке.',
+        )
+
+    def handle(self, *args, **options):
+        tasks = [
+            (backfill, first_id, last_id)
+            for first_id, last_id in pk_chunks(Post, options['chunk_size'])
+        ]
+        results = run_tasks(tasks, options['workers'])
+        filled = sum(result[0] for result in results)
+        missing = sum(result[1] for result in results)
+        self.stdout.write(self.style.SUCCESS(
+            f'Заполнено: {filled}, файлов не найдено: {missing}'
+        ))
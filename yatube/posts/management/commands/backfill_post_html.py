@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+
+from posts.management.batches import pk_chunks, run_tasks
+from posts.models import Post
+
+FIELDS = ('text_html', 'title_snippet')
+
+
+def backfill(first_id, last_id, force=False):
+    """Заполняет готовый HTML текста постов first_id..last_id."""
+    posts = Post.objects.filter(pk__range=(first_id, last_id))
+    if not force:
+        posts = posts.filter(text_html='')
+    posts = list(posts.only('pk', 'text'))
+    for post in posts:
+        post.render_text()
+    Post.objects.bulk_update(posts, FIELDS)
+    return len(posts)
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет text_html и title_snippet у постов, сохранённых до '
+        'появления этих полей или в обход Post.save().'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Сколько пачек обрабатывать параллельно.',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Сколько постов в одной пачке.',
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Пересчитать и уже заполненные, например после смены '
+                 'фильтров.',
+        )
+
+    def handle(self, *args, **options):
+        tasks = [
+            (backfill, first_id, last_id, options['force'])
+            for first_id, last_id in pk_chunks(Post, options['chunk_size'])
+        ]
+        results = run_tasks(tasks, options['workers'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Заполнено: {sum(results)}'
+        ))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from posts.feeds import backfill_follow
+from posts.models import Follow, TimelineEntry
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет ленты подписок по существующим подпискам Follow. '
+        'Авторы с флагом UserStats.pulled пропускаются: их посты '
+        'дочитываются при показе ленты.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Очистить ленты перед заполнением.',
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            TimelineEntry.objects.all().delete()
+        follows = Follow.objects.values_list('user_id', 'author_id')
+        inserted = 0
+        for number, (user_id, author_id) in enumerate(follows.iterator(), 1):
+            inserted += backfill_follow(user_id, author_id)
+            if number % 1000 == 0:
+                self.stdout.write(f'Подписок обработано: {number}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово, записей лент обработано: {inserted}'
+        ))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = (
+        'Запускает замер производительности на синтетических данных. '
+        'Данные создаются в транзакции и откатываются после замера.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(BENCHMARKS))
+        parser.add_argument(
+            '--size', type=int, default=10000,
+            help='Сколько постов создать для замера.',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=50,
+            help='Сколько раз повторить каждый замер.',
+        )
+
+    def handle(self, *args, **options):
+        scenario = BENCHMARKS[options['name']]
+        with transaction.atomic():
+            scenario(self.stdout, options['size'], options['repeat'])
+            transaction.set_rollback(True)
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.caching import purge_surrogate_keys, surrogate_key
+from posts.models import Post, PostTag, Tag
+from posts.tags import hashtags
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет хэштеги постов заново по их текстам. Нужен один раз '
+        'для постов, написанных до появления тегов: дальше теги '
+        'обновляются при сохранении постов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Сколько постов обрабатывать в одной транзакции.',
+        )
+
+    def handle(self, *args, **options):
+        last_id = tagged = 0
+        while True:
+            posts = list(
+                Post.objects.filter(pk__gt=last_id).order_by('pk').values_list(
+                    'pk', 'pub_date', 'text'
+                )[:options['chunk_size']]
+            )
+            if not posts:
+                break
+            last_id = posts[-1][0]
+            names = {pk: hashtags(text) for pk, _, text in posts}
+            chunk_names = set().union(*names.values())
+            with transaction.atomic():
+                # Старые теги пачки тоже сбрасываются: их ленты меняются.
+                old_names = set(PostTag.objects.filter(
+                    post__id__range=(posts[0][0], last_id)
+                ).values_list('tag__name', flat=True))
+                Tag.objects.bulk_create(
+                    [Tag(name=name) for name in chunk_names],
+                    ignore_conflicts=True,
+                )
+                tag_ids = dict(Tag.objects.filter(
+                    name__in=chunk_names
+                ).values_list('name', 'pk'))
+                PostTag.objects.filter(
+                    post__id__range=(posts[0][0], last_id)
+                ).delete()
+                PostTag.objects.bulk_create(
+                    PostTag(
+                        tag_id=tag_ids[name], post_id=pk, pub_date=pub_date
+                    )
+                    for pk, pub_date, _ in posts
+                    for name in names[pk]
+                )
+            purge_surrogate_keys(*(
+                surrogate_key('tag', name) for name in chunk_names | old_names
+            ))
+            tagged += len(posts)
+            self.stdout.write(f'Постов: {tagged}, последний id {last_id}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово, обработано постов: {tagged}'
+        ))
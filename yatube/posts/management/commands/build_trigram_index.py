@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.caching import purge_surrogate_keys
+from posts.models import Post, PostTrigram
+from posts.search import trigrams
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет триграммный индекс поиска заново по текстам постов. '
+        'Нужен один раз при переходе на SEARCH_BACKEND=trigram: дальше '
+        'индекс обновляется при сохранении постов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Сколько постов индексировать в одной транзакции.',
+        )
+
+    def handle(self, *args, **options):
+        last_id = indexed = 0
+        while True:
+            posts = list(
+                Post.objects.filter(pk__gt=last_id).order_by('pk').values_list(
+                    'pk', 'text'
+                )[:options['chunk_size']]
+            )
+            if not posts:
+                break
+            last_id = posts[-1][0]
+            with transaction.atomic():
+                PostTrigram.objects.filter(
+                    post__id__range=(posts[0][0], last_id)
+                ).delete()
+                PostTrigram.objects.bulk_create(
+                    PostTrigram(trigram=trigram, post_id=pk)
+                    for pk, text in posts
+                    for trigram in trigrams(text)
+                )
+            indexed += len(posts)
+            self.stdout.write(f'Постов: {indexed}, последний id {last_id}')
+        # Кэшированные страницы поиска показывали старый индекс.
+        purge_surrogate_keys('posts')
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово, проиндексировано постов: {indexed}'
+        ))
@@ -0,0 +1,253 @@
+import os
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.template.defaultfilters import filesizeformat
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.helpers import deserialize
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore
+
+from posts.models import Post, StoredFile
+from posts.storage import walk_files
+from posts.thumbnails import thumbnail_file, thumbnail_variants
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def referenced_images(names):
+    """Какие из names указаны в Post.image."""
+    return set(
+        Post.objects.filter(image__in=names).values_list('image', flat=True)
+    )
+
+
+def current_thumbnail_keys(name, variants):
+    """Ключи миниатюр name во всех нынешних размерах и форматах."""
+    return {
+        thumbnail_file(name, geometry_string, options).key
+        for geometry_string, options in variants
+    }
+
+
+def thumbnail_lists(sources):
+    """{источник: ключи его миниатюр в kvstore} одним запросом."""
+    keys = {
+        add_prefix(source.key, identity='thumbnails'): source
+        for source in sources
+    }
+    return {
+        keys[key]: deserialize(value)
+        for key, value in KVStore.objects.filter(
+            key__in=keys
+        ).values_list('key', 'value')
+    }
+
+
+def known_thumbnails(names):
+    """Какие из миниатюр names ещё записаны в kvstore sorl."""
+    keys = {
+        add_prefix(ImageFile(name, default.storage).key): name
+        for name in names
+    }
+    return {
+        keys[key]
+        for key in KVStore.objects.filter(key__in=keys).values_list(
+            'key', flat=True
+        )
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет из MEDIA_ROOT картинки, на которые не ссылается ни один '
+        'пост, и миниатюры, которых нет в kvstore sorl. Сначала из '
+        'kvstore убираются записи об удалённых картинках вместе с их '
+        'миниатюрами и записи о миниатюрах размеров, которых больше нет '
+        'в POST_THUMBNAILS. Память не растёт с числом файлов: и файлы, и '
+        'ссылки на них проверяются пачками.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, что будет удалено.',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Сколько файлов или записей проверять одним запросом.',
+        )
+        parser.add_argument(
+            '--min-age', type=int, default=60 * 60,
+            help='Не трогать файлы моложе стольких секунд: пост с только '
+                 'что загруженной картинкой может быть ещё не сохранён.',
+        )
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.verbosity = options['verbosity']
+        self.chunk_size = options['chunk_size']
+        self.newer_than = time.time() - options['min_age']
+        self.removed = self.freed = 0
+        forgotten, outdated = self.forget_sources()
+        storage = Post._meta.get_field('image').storage
+        self.collect(
+            storage,
+            Post._meta.get_field('image').upload_to,
+            referenced_images,
+        )
+        self.collect(
+            default.storage,
+            thumbnail_settings.THUMBNAIL_PREFIX,
+            known_thumbnails,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Будет удалено" if self.dry_run else "Удалено"} файлов: '
+            f'{self.removed}, освобождается {filesizeformat(self.freed)}; '
+            f'записей kvstore об удалённых картинках: {forgotten}, '
+            f'об устаревших миниатюрах: {outdated}'
+        ))
+
+    def source_entries(self):
+        """Записи kvstore об исходных картинках, пачками по ключу."""
+        prefix = add_prefix('')
+        last_key = prefix
+        while True:
+            rows = list(
+                KVStore.objects.filter(
+                    key__gt=last_key, key__startswith=prefix
+                ).order_by('key').values_list('key', 'value')[
+                    :self.chunk_size
+                ]
+            )
+            if not rows:
+                return
+            last_key = rows[-1][0]
+            yield [
+                image_file for image_file in (
+                    deserialize_image_file(value) for _, value in rows
+                )
+                if not image_file.name.startswith(
+                    thumbnail_settings.THUMBNAIL_PREFIX
+                )
+            ]
+
+    def forget_sources(self):
+        """
+        Убирает из kvstore картинки, на которые больше нет ссылок,
+        и миниатюры живых картинок в размерах и форматах, которых
+        уже нет в настройках.
+
+        Вместе с записью sorl об удалённой картинке удаляются и файлы
+        её миниатюр; файлы устаревших миниатюр затем удалит проход
+        по каталогу миниатюр. В пробном запуске записи остаются, и эти
+        миниатюры в счёт файлов не попадают.
+
+        Возвращает (удалённых картинок, устаревших миниатюр).
+        """
+        variants = [
+            (geometry_string, options)
+            for geometry in settings.POST_THUMBNAILS
+            for *_, geometry_string, options in thumbnail_variants(geometry)
+        ]
+        forgotten = outdated = 0
+        for sources in self.source_entries():
+            referenced = referenced_images(
+                [source.name for source in sources]
+            )
+            alive = []
+            for source in sources:
+                if source.name in referenced:
+                    alive.append(source)
+                    continue
+                forgotten += 1
+                if not self.dry_run:
+                    default.kvstore.delete(source)
+            for source, keys in thumbnail_lists(alive).items():
+                current = current_thumbnail_keys(source.name, variants)
+                stale = [key for key in keys if key not in current]
+                outdated += len(stale)
+                if stale and not self.dry_run:
+                    self.forget_thumbnails(source, keys, stale)
+        return forgotten, outdated
+
+    @staticmethod
+    def forget_thumbnails(source, keys, stale):
+        """Убирает stale из kvstore и из списка миниатюр source."""
+        kvstore = default.kvstore
+        for key in stale:
+            kvstore._delete(key)
+        kept = [key for key in keys if key not in stale]
+        if kept:
+            kvstore._set(source.key, kept, identity='thumbnails')
+        else:
+            kvstore._delete(source.key, identity='thumbnails')
+
+    def collect(self, storage, directory, is_alive):
+        root = storage.path(directory)
+        if not os.path.isdir(root):
+            return
+        for entries in chunked(walk_files(root), self.chunk_size):
+            names = {
+                os.path.relpath(entry.path, storage.location).replace(
+                    os.sep, '/'
+                ): entry
+                for entry in entries
+            }
+            alive = is_alive(list(names))
+            orphans = {}
+            for name, entry in names.items():
+                file_stat = entry.stat(follow_symlinks=False)
+                if name in alive or file_stat.st_mtime > self.newer_than:
+                    continue
+                orphans[name] = file_stat.st_size
+            if orphans and not self.dry_run:
+                orphans = self.remove(orphans, names, is_alive)
+            for name, size in orphans.items():
+                self.removed += 1
+                self.freed += size
+                if self.verbosity > 1:
+                    self.stdout.write(name)
+
+    def remove(self, orphans, names, is_alive):
+        """
+        Удаляет файлы, если они всё ещё никому не нужны, и возвращает
+        удалённые.
+
+        Пока шла проверка пачки, новый пост мог сослаться на тот же
+        файл: storage.save обновляет mtime при повторной загрузке.
+        Поэтому ссылки и mtime проверяются ещё раз в транзакции,
+        под блокировкой записей StoredFile.
+        """
+        with transaction.atomic():
+            list(
+                StoredFile.objects.select_for_update().filter(
+                    name__in=orphans
+                ).values_list('pk', flat=True)
+            )
+            alive = is_alive(list(orphans))
+            confirmed = {}
+            for name, size in orphans.items():
+                try:
+                    mtime = os.stat(names[name].path).st_mtime
+                except FileNotFoundError:
+                    continue
+                if name not in alive and mtime <= self.newer_than:
+                    confirmed[name] = size
+            StoredFile.objects.filter(name__in=confirmed).delete()
+            for name in confirmed:
+                os.remove(names[name].path)
+        return confirmed
@@ -0,0 +1,116 @@
+import os
+import shutil
+from functools import partial
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.template.defaultfilters import filesizeformat
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from posts.caching import post_surrogate_keys, purge_surrogate_keys
+from posts.models import Post, StoredFile
+from posts.storage import HASHED_NAME, file_digest, hashed_name, walk_files
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит картинки из MEDIA_ROOT/posts/ в хранилище по '
+        'содержимому: одинаковые файлы остаются в одном экземпляре, '
+        'посты перенаправляются на него, счётчики ссылок пересчитываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, что будет сделано.',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        storage = Post._meta.get_field('image').storage
+        root = storage.path('posts')
+        if not os.path.isdir(root):
+            self.stdout.write('Каталог posts/ пуст.')
+            return
+        seen = set()
+        moved = removed = freed = 0
+        for entry in walk_files(root):
+            name = os.path.relpath(entry.path, storage.location).replace(
+                os.sep, '/'
+            )
+            if HASHED_NAME.search(name):
+                continue
+            with open(entry.path, 'rb') as content:
+                target = hashed_name(name, file_digest(File(content)))
+            if target in seen or storage.exists(target):
+                removed += 1
+                freed += entry.stat().st_size
+            else:
+                moved += 1
+            seen.add(target)
+            if not dry_run:
+                self.move(storage, entry.path, name, target)
+        if not dry_run:
+            self.recount_references()
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Будет перенесено" if dry_run else "Перенесено"}: {moved}, '
+            f'дублей: {removed}, освобождается {filesizeformat(freed)}'
+        ))
+
+    def move(self, storage, path, name, target):
+        """
+        Старый файл удаляется только после того, как посты в базе
+        перенаправлены на новый: прерванный перенос ничего не теряет,
+        а повторный запуск его доделывает.
+        """
+        target_path = storage.path(target)
+        if not os.path.exists(target_path):
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            self.link(path, target_path)
+        with transaction.atomic():
+            posts = Post.objects.filter(image=name)
+            keys = {
+                key
+                for post in posts.select_related('author', 'group')
+                for key in post_surrogate_keys(post)
+            }
+            updated = posts.update(image=target)
+            if updated:
+                storage.add_references(target, updated)
+            StoredFile.objects.filter(name=name).delete()
+            transaction.on_commit(partial(self.forget, storage, path, name))
+            transaction.on_commit(partial(purge_surrogate_keys, *keys))
+
+    @staticmethod
+    def link(path, target_path):
+        """Жёсткая ссылка на path, а на другой ФС — копия через tmp."""
+        try:
+            os.link(path, target_path)
+        except OSError:
+            temporary = f'{target_path}.tmp'
+            shutil.copy2(path, temporary)
+            os.replace(temporary, target_path)
+
+    @staticmethod
+    def forget(storage, path, name):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        # Миниатюры старого имени больше не нужны, новые создадутся
+        # при первом показе.
+        default.kvstore.delete(ImageFile(name, storage))
+
+    @transaction.atomic
+    def recount_references(self):
+        StoredFile.objects.all().delete()
+        StoredFile.objects.bulk_create(
+            StoredFile(name=row['image'], references=row['references'])
+            for row in Post.objects.exclude(image='').values(
+                'image'
+            ).annotate(references=Count('id')).order_by()
+        )
@@ -0,0 +1,80 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from posts.feeds import TimelineSource
+from posts.models import Comment, Follow, Post, Tag, User
+from posts.paginators import QuerySetSource
+from posts.tags import TagSource
+
+TEMP_SORT = 'USE TEMP B-TREE'
+
+
+def feed_queries():
+    """Запросы, которые выполняют ленты и страница поста."""
+    cursor = (timezone.now(), 1)
+    limit = settings.POSTS_QUANTITY + 1
+    user = User(pk=1)
+    posts = Post.objects.select_related('author', 'group')
+    feeds = {
+        'index': QuerySetSource(posts),
+        'group_posts': QuerySetSource(posts.filter(group_id=1)),
+        'profile': QuerySetSource(posts.filter(author_id=1)),
+        'follow_index': TimelineSource(user),
+        'tag_posts': TagSource(Tag(pk=1)),
+    }
+    for name, source in feeds.items():
+        yield f'{name}: первая страница', source.window(limit=limit)
+        yield f'{name}: ?after=', source.window(cursor, limit=limit)
+        yield f'{name}: ?before=', source.window(
+            cursor, reverse=True, limit=limit)
+        yield f'{name}: валидатор', source.queryset.values_list(
+            'pub_date', source.id_field)[:1]
+    last_comment = Comment.objects.filter(
+        post=OuterRef('pk')).order_by('-created').values('created')[:1]
+    yield 'post_detail: валидатор', Post.objects.filter(pk=1).annotate(
+        last_comment=Subquery(last_comment)).values_list(
+        'author__username', 'pub_date', 'last_comment')[:1]
+    yield 'post_detail: комментарии', Comment.objects.filter(
+        post_id=1).select_related('author').order_by('created')
+    yield 'profile: подписка', Follow.objects.filter(
+        user_id=1, author__username='author')
+
+
+class Command(BaseCommand):
+    help = (
+        'Печатает EXPLAIN QUERY PLAN для запросов лент на SQLite '
+        'и отмечает запросы, которые сортируют без индекса.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--strict', action='store_true',
+            help='Завершиться с ошибкой, если есть сортировка без индекса.',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN есть только в SQLite.')
+        unordered = []
+        with connection.cursor() as cursor:
+            for name, queryset in feed_queries():
+                sql, params = queryset.query.sql_with_params()
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                plan = [row[-1] for row in cursor.fetchall()]
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                for step in plan:
+                    self.stdout.write(f'  {step}')
+                if any(TEMP_SORT in step for step in plan):
+                    unordered.append(name)
+        if unordered:
+            message = 'Сортировка без индекса: ' + ', '.join(unordered)
+            if options['strict']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                'Все запросы лент упорядочены по индексу.'
+            ))
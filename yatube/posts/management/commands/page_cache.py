@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+
+from posts.caching import (
+    page_cache_stats, purge_surrogate_keys, reset_page_cache_stats,
+)
+from posts.thumbnails import reset_thumbnail_misses, thumbnail_misses
+
+
+class Command(BaseCommand):
+    help = (
+        'Показывает долю попаданий в кэш страниц для анонимов '
+        'и число отрисовок картинок без готовой миниатюры. '
+        'Чтобы обойти кэш, запустите сервер с YATUBE_PAGE_CACHE=0 '
+        'или пошлите заголовок Cache-Control: no-cache.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--purge',
+            nargs='+',
+            metavar='KEY',
+            default=[],
+            help='Сбросить страницы с ключами вида post:1, group:slug, '
+                 'author:username или posts.',
+        )
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Обнулить счётчики попаданий, промахов и миниатюр.',
+        )
+
+    def handle(self, *args, **options):
+        if options['purge']:
+            purge_surrogate_keys(*options['purge'])
+            self.stdout.write(
+                f'Сброшены ключи: {" ".join(options["purge"])}'
+            )
+        hits, misses = page_cache_stats()
+        total = hits + misses
+        ratio = hits / total if total else 0
+        self.stdout.write(
+            f'Попаданий: {hits}, промахов: {misses}, доля: {ratio:.1%}'
+        )
+        self.stdout.write(
+            f'Отрисовок без готовой миниатюры: {thumbnail_misses()}'
+        )
+        if options['reset']:
+            reset_page_cache_stats()
+            reset_thumbnail_misses()
+            self.stdout.write(self.style.SUCCESS('Счётчики обнулены'))
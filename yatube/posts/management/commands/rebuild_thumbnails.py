@@ -0,0 +1,124 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.thumbnails import generate_thumbnails
+
+logger = logging.getLogger(__name__)
+
+
+def rebuild(name):
+    """Создаёт миниатюры файла name; ошибка не прерывает весь проход."""
+    try:
+        generate_thumbnails(name)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры для %s', name)
+        return False
+    return True
+
+
+def read_checkpoint(path):
+    try:
+        with open(path) as checkpoint:
+            return int(checkpoint.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def write_checkpoint(path, last_id):
+    # Через временный файл, чтобы падение не оставило обрезанную запись.
+    with open(f'{path}.tmp', 'w') as checkpoint:
+        checkpoint.write(str(last_id))
+    os.replace(f'{path}.tmp', path)
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт заново миниатюры POST_THUMBNAILS для всех постов, '
+        'например после смены геометрии. Прогресс сохраняется в файл, '
+        'повторный запуск продолжает с места остановки.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.POST_THUMBNAIL_WORKERS,
+            help='Процессов в пуле; 0 — в текущем процессе.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Сколько постов между сохранениями прогресса.',
+        )
+        parser.add_argument(
+            '--rate', type=float, default=0,
+            help='Не больше стольких файлов в секунду; 0 — без ограничения.',
+        )
+        parser.add_argument(
+            '--checkpoint', default='rebuild_thumbnails.checkpoint',
+            help='Файл с id последнего обработанного поста.',
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Начать сначала, не глядя на сохранённый прогресс.',
+        )
+
+    def handle(self, *args, **options):
+        checkpoint = options['checkpoint']
+        last_id = 0 if options['restart'] else read_checkpoint(checkpoint)
+        if last_id:
+            self.stdout.write(f'Продолжаем после поста {last_id}')
+        posts = Post.objects.exclude(image='').order_by('pk')
+        pool = None
+        if options['workers']:
+            pool = ProcessPoolExecutor(
+                max_workers=options['workers'],
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            )
+        rebuilt = failed = 0
+        started = time.monotonic()
+        try:
+            while True:
+                # Пачки по ключу, а не один курсор на весь проход: открытое
+                # чтение в SQLite мешало бы пулу писать в kvstore.
+                batch = list(posts.filter(pk__gt=last_id).values_list(
+                    'pk', 'image'
+                )[:options['batch_size']])
+                if not batch:
+                    break
+                last_id = batch[-1][0]
+                # Одинаковые картинки хранятся одним файлом.
+                names = list(dict.fromkeys(image for _, image in batch))
+                results = (
+                    pool.map(rebuild, names) if pool
+                    else map(rebuild, names)
+                )
+                for result in results:
+                    rebuilt += result
+                    failed += not result
+                write_checkpoint(checkpoint, last_id)
+                elapsed = time.monotonic() - started
+                done = rebuilt + failed
+                self.stdout.write(
+                    f'Файлов: {done}, ошибок: {failed}, '
+                    f'{done / elapsed if elapsed else 0:.1f}/с, '
+                    f'последний id {last_id}'
+                )
+                if options['rate']:
+                    # Ровняем среднюю скорость, чтобы не мешать живым
+                    # запросам к диску и базе.
+                    time.sleep(max(done / options['rate'] - elapsed, 0))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: миниатюры созданы для {rebuilt}, ошибок: {failed}'
+        ))
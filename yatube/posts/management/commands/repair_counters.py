@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import repair_posts, repair_users
+from posts.management.batches import pk_chunks, run_tasks
+from posts.models import Post, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет денормализованные счётчики постов, комментариев '
+        'и подписок с реальными данными и исправляет расхождения.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только показать расхождения, ничего не исправлять.',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Сколько пачек обрабатывать параллельно.',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help='Сколько записей в одной пачке.',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['check']
+        tasks = [
+            (repair_users, first_id, last_id, dry_run)
+            for first_id, last_id in pk_chunks(User, options['chunk_size'])
+        ] + [
+            (repair_posts, first_id, last_id, dry_run)
+            for first_id, last_id in pk_chunks(Post, options['chunk_size'])
+        ]
+        drifted = sum(run_tasks(tasks, options['workers']))
+        verb = 'найдено' if dry_run else 'исправлено'
+        self.stdout.write(self.style.SUCCESS(
+            f'Расхождений {verb}: {drifted}'
+        ))
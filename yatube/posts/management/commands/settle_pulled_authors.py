@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.feeds import release_pulled_author
+from posts.models import UserStats
+
+
+class Command(BaseCommand):
+    help = (
+        'Возвращает к раскладке по лентам авторов, у которых подписчиков '
+        'снова не больше FEED_FAN_OUT_THRESHOLD, и раскладывает их '
+        'последние посты. До этого их посты дочитываются при показе '
+        'ленты. Запускается по расписанию.'
+    )
+
+    def handle(self, *args, **options):
+        author_ids = UserStats.objects.filter(
+            pulled=True,
+            followers_count__lte=settings.FEED_FAN_OUT_THRESHOLD,
+        ).values_list('user_id', flat=True)
+        released = inserted = 0
+        for author_id in list(author_ids):
+            entries = release_pulled_author(author_id)
+            inserted += entries
+            released += 1
+            self.stdout.write(f'Автор {author_id}: записей лент {entries}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово, авторов возвращено к раскладке: {released}, '
+            f'записей лент: {inserted}'
+        ))
@@ -1,8 +1,18 @@
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.template.defaultfilters import linebreaksbr, truncatechars
+
+from .storage import ContentAddressedStorage
 
 User = get_user_model()
 
+# Столько символов текста поста уходит в заголовок страницы.
+TITLE_LENGTH = 30
+# Поля Post, которые меняются только атомарными UPDATE.
+COUNTERS = ('comments_count',)
+# Хэштеги длиннее не индексируются.
+TAG_MAX_LENGTH = 50
+
 
 class Group(models.Model):
     title = models.CharField(max_length=200)
@@ -31,15 +41,78 @@ class Post(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True
     )
+    # Метаданные картинки сохраняются при загрузке, чтобы показ
+    # ленты не открывал файлы.
+    width = models.PositiveIntegerField(
+        'Ширина картинки', null=True, editable=False
+    )
+    height = models.PositiveIntegerField(
+        'Высота картинки', null=True, editable=False
+    )
+    format = models.CharField(
+        'Формат картинки', max_length=10, blank=True, editable=False
+    )
+    bytes = models.PositiveIntegerField(
+        'Размер картинки в байтах', null=True, editable=False
+    )
+    placeholder = models.TextField(
+        'Заглушка картинки', blank=True, editable=False
+    )
+    comments_count = models.IntegerField(default=0, editable=False)
+    # Текст, уже пропущенный через фильтры шаблонов: лента выводит
+    # готовые строки, а не обрабатывает текст при каждом показе.
+    text_html = models.TextField(
+        'Текст в HTML', blank=True, editable=False
+    )
+    title_snippet = models.CharField(
+        'Начало текста для заголовка', max_length=TITLE_LENGTH,
+        blank=True, editable=False
+    )
 
     class Meta:
-        ordering = ['-pub_date']
+        ordering = ['-pub_date', '-id']
+        indexes = [
+            models.Index(
+                fields=['pub_date', 'id'],
+                name='post_date_idx'
+            ),
+            models.Index(
+                fields=['group', 'pub_date', 'id'],
+                name='post_group_date_idx'
+            ),
+            models.Index(
+                fields=['author', 'pub_date', 'id'],
+                name='post_author_date_idx'
+            ),
+        ]
 
     def __str__(self) -> str:
         return self.text[:15]
 
+    def render_text(self):
+        """Заполняет text_html и title_snippet по текущему тексту."""
+        self.text_html = linebreaksbr(self.text, autoescape=True)
+        self.title_snippet = truncatechars(self.text, TITLE_LENGTH)
+
+    def save(self, *args, **kwargs):
+        self.render_text()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding:
+            # Счётчики сдвигаются только через F() в counters.py: полное
+            # сохранение записало бы поверх значение, прочитанное раньше.
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in COUNTERS
+            ]
+        elif update_fields is not None and 'text' in update_fields:
+            kwargs['update_fields'] = {
+                *update_fields, 'text_html', 'title_snippet'
+            }
+        super().save(*args, **kwargs)
+
 
 class Comment(models.Model):
     author = models.ForeignKey(
@@ -55,6 +128,14 @@ class Comment(models.Model):
         related_name='comments'
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['post', 'created'],
+                name='comment_post_created_idx'
+            ),
+        ]
+
 
 class Follow(models.Model):
     user = models.ForeignKey(
@@ -84,3 +165,133 @@ class Follow(models.Model):
                 fields=('user', 'author')
             ),
         ]
+
+
+class UserStats(models.Model):
+    """Счётчики пользователя, которые поддерживаются при записи."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+    )
+    posts_count = models.IntegerField(default=0)
+    followers_count = models.IntegerField(default=0, db_index=True)
+    following_count = models.IntegerField(default=0)
+    # Посты автора дочитываются при показе ленты, а не раскладываются.
+    # Флаг снимает settle_pulled_authors, когда разложит посты,
+    # написанные за это время.
+    pulled = models.BooleanField(default=False, db_index=True)
+
+
+class TimelineEntry(models.Model):
+    """Запись ленты подписок: пост автора, разложенный подписчику."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-pub_date', '-id']
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='timeline_user_post_idx'
+            ),
+            models.Index(
+                fields=['user', 'author'],
+                name='timeline_user_author_idx'
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                name='unique_timeline_entry',
+                fields=('user', 'post')
+            ),
+        ]
+
+
+class StoredFile(models.Model):
+    """Файл хранилища по содержимому и число ссылок на него."""
+    name = models.CharField(max_length=255, primary_key=True)
+    references = models.PositiveIntegerField(default=0)
+
+
+class PostTrigram(models.Model):
+    """
+    Триграмма текста поста: строка инвертированного индекса поиска
+    для баз без FTS5.
+    """
+    trigram = models.CharField(max_length=3)
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+
+    class Meta:
+        constraints = [
+            # Этот же индекс отдаёт список постов триграммы.
+            models.UniqueConstraint(
+                name='unique_post_trigram',
+                fields=('trigram', 'post')
+            ),
+        ]
+
+
+class Tag(models.Model):
+    """Хэштег из текста постов, имя хранится без # в нижнем регистре."""
+    name = models.CharField(max_length=TAG_MAX_LENGTH, unique=True)
+    posts = models.ManyToManyField(
+        Post,
+        through='PostTag',
+        related_name='tags',
+    )
+
+    def __str__(self) -> str:
+        return f'#{self.name}'
+
+
+class PostTag(models.Model):
+    """
+    Пост с хэштегом. Дата поста копируется сюда, чтобы лента тега
+    читалась одним диапазоном индекса.
+    """
+    tag = models.ForeignKey(
+        Tag,
+        on_delete=models.CASCADE,
+        related_name='entries',
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-pub_date', '-id']
+        indexes = [
+            models.Index(
+                fields=['tag', '-pub_date', '-post'],
+                name='post_tag_date_idx'
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                name='unique_post_tag',
+                fields=('tag', 'post')
+            ),
+        ]
@@ -0,0 +1,255 @@
+import hashlib
+import heapq
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_bytes, force_str
+from django.utils.functional import cached_property
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+# Число записей нужно только для ссылок на дальние страницы,
+# поэтому COUNT(*) выполняется не чаще раза в минуту на ленту.
+COUNT_CACHE_TTL = 60
+# Больше не поместится в целое SQL: ключ или номер из токена за этим
+# пределом подделан.
+MAX_CURSOR_VALUE = 2 ** 63 - 1
+
+
+def post_key(post):
+    return post.pub_date, post.pk
+
+
+def encode_cursor(post, number):
+    """Упаковывает ключ (pub_date, id) и номер страницы в токен."""
+    raw = f'{post.pub_date.isoformat()}|{post.pk}|{number}'
+    return urlsafe_base64_encode(force_bytes(raw))
+
+
+def decode_cursor(token):
+    """Возвращает (pub_date, id, number) или None для битого токена."""
+    try:
+        raw = force_str(urlsafe_base64_decode(token))
+        pub_date, pk, number = raw.split('|')
+        pub_date = parse_datetime(pub_date)
+        pk, number = int(pk), int(number)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        return None
+    if pub_date is None:
+        return None
+    if not (0 <= pk <= MAX_CURSOR_VALUE and 1 <= number <= MAX_CURSOR_VALUE):
+        return None
+    return pub_date, pk, number
+
+
+def merge_rows(lists, reverse=False):
+    """k-way слияние упорядоченных списков постов с удалением дублей."""
+    merged = []
+    last_pk = None
+    for post in heapq.merge(*lists, key=post_key, reverse=not reverse):
+        if post.pk != last_pk:
+            merged.append(post)
+            last_pk = post.pk
+    return merged
+
+
+class QuerySetSource:
+    """Источник ленты: queryset, упорядоченный по (pub_date, id_field)."""
+
+    def __init__(self, queryset, id_field='id'):
+        self.id_field = id_field
+        self.queryset = queryset.order_by('-pub_date', f'-{id_field}')
+
+    def to_post(self, row):
+        return row
+
+    def count(self):
+        sql = str(self.queryset.query).encode()
+        return cache.get_or_set(
+            f'feeds:count:{hashlib.md5(sql).hexdigest()}',
+            self.queryset.count,
+            COUNT_CACHE_TTL,
+        )
+
+    def latest_key(self):
+        """Ключ (pub_date, id) самого свежего поста: одно чтение индекса."""
+        return self.queryset.values_list('pub_date', self.id_field).first()
+
+    def window(self, cursor=None, reverse=False, offset=0, limit=None):
+        """Queryset одного окна ленты после (или до) курсора."""
+        queryset = self.queryset
+        if cursor is not None:
+            pub_date, pk = cursor
+            lookup = 'gt' if reverse else 'lt'
+            queryset = queryset.filter(
+                Q(**{f'pub_date__{lookup}': pub_date})
+                | Q(pub_date=pub_date, **{f'{self.id_field}__{lookup}': pk})
+            )
+        if reverse:
+            queryset = queryset.reverse()
+        return queryset[offset:offset + limit]
+
+    def rows(self, cursor=None, reverse=False, offset=0, limit=None):
+        return [
+            self.to_post(row)
+            for row in self.window(cursor, reverse, offset, limit)
+        ]
+
+
+def as_sources(object_list):
+    """Queryset, источник или их список — список источников ленты."""
+    if not isinstance(object_list, (list, tuple)):
+        object_list = [object_list]
+    return [
+        source if hasattr(source, 'rows') else QuerySetSource(source)
+        for source in object_list
+    ]
+
+
+def latest_post_key(object_list):
+    """Ключ самого свежего поста ленты или None для пустой ленты."""
+    keys = [source.latest_key() for source in as_sources(object_list)]
+    return max(filter(None, keys), default=None)
+
+
+class CursorPaginator(Paginator):
+    """
+    Пагинация по ключу (pub_date, id) без COUNT(*) и OFFSET.
+
+    Страницы листаются токенами ?after=/?before=, старые ссылки
+    вида ?page=N по-прежнему работают через OFFSET. Лента может
+    собираться из нескольких источников, они сливаются по ключу.
+    """
+
+    ELLIPSIS = '…'
+
+    def __init__(self, object_list, per_page, **kwargs):
+        self.sources = as_sources(object_list)
+        super().__init__(self.sources, per_page, **kwargs)
+        self._last_known_page = 1
+
+    @cached_property
+    def count(self):
+        return sum(source.count() for source in self.sources)
+
+    @property
+    def num_pages(self):
+        """Страницы, известные без COUNT: текущая и следующая, если есть."""
+        return self._last_known_page
+
+    @property
+    def total_pages(self):
+        """Всего страниц по закэшированному COUNT(*)."""
+        return max((self.count - 1) // self.per_page + 1, 1)
+
+    def get_elided_page_range(self, number=1, on_each_side=2, on_ends=1):
+        """
+        Номера страниц вокруг текущей, первые и последние, а между
+        ними ELLIPSIS. Как одноимённый метод Paginator из Django 3.2.
+        """
+        total = max(self.total_pages, self._last_known_page)
+        if total <= (on_each_side + on_ends) * 2:
+            yield from range(1, total + 1)
+            return
+        if number > (1 + on_each_side + on_ends) + 1:
+            yield from range(1, on_ends + 1)
+            yield self.ELLIPSIS
+            yield from range(number - on_each_side, number + 1)
+        else:
+            yield from range(1, number + 1)
+        if number < (total - on_each_side - on_ends) - 1:
+            yield from range(number + 1, number + on_each_side + 1)
+            yield self.ELLIPSIS
+            yield from range(total - on_ends + 1, total + 1)
+        else:
+            yield from range(number + 1, total + 1)
+
+    def get_cursor_page(self, after=None, before=None, page=None):
+        if after:
+            cursor = decode_cursor(after)
+            if cursor is not None:
+                return self._page_after(*cursor)
+        if before:
+            cursor = decode_cursor(before)
+            if cursor is not None:
+                return self._page_before(*cursor)
+        return self._page_by_number(page)
+
+    def _fetch(self, cursor=None, reverse=False, offset=0):
+        limit = self.per_page + 1
+        if len(self.sources) == 1:
+            return self.sources[0].rows(cursor, reverse, offset, limit)
+        rows = merge_rows(
+            [
+                source.rows(cursor, reverse, 0, offset + limit)
+                for source in self.sources
+            ],
+            reverse,
+        )
+        return rows[offset:offset + limit]
+
+    def _page_after(self, pub_date, pk, number):
+        rows = self._fetch((pub_date, pk))
+        return self._build_page(
+            rows[:self.per_page], number + 1,
+            has_previous=True,
+            has_next=len(rows) > self.per_page,
+        )
+
+    def _page_before(self, pub_date, pk, number):
+        rows = self._fetch((pub_date, pk), reverse=True)
+        has_previous = len(rows) > self.per_page
+        rows = rows[:self.per_page][::-1]
+        return self._build_page(
+            rows, max(number - 1, 2) if has_previous else 1,
+            has_previous=has_previous,
+            has_next=True,
+        )
+
+    def _page_by_number(self, number):
+        try:
+            number = max(int(number), 1)
+        except (TypeError, ValueError):
+            number = 1
+        if number > 1:
+            # Огромный номер не должен доходить до OFFSET; запас в одну
+            # страницу — на случай, если COUNT в кэше чуть устарел.
+            number = min(number, self.total_pages + 1)
+        rows = self._fetch(offset=(number - 1) * self.per_page)
+        if not rows and number > 1 and self.total_pages < number:
+            # Ссылка ведёт за конец ленты: как и Paginator.get_page,
+            # отдаём последнюю страницу.
+            return self._page_by_number(self.total_pages)
+        return self._build_page(
+            rows[:self.per_page], number,
+            has_previous=number > 1,
+            has_next=len(rows) > self.per_page,
+        )
+
+    def _build_page(self, rows, number, has_previous, has_next):
+        self._last_known_page = number + 1 if has_next else number
+        page = self._get_page(rows, number, self)
+        # Шаблон вызывает page_links без аргументов, и только тогда
+        # понадобится COUNT(*).
+        page.page_links = partial(self.get_elided_page_range, number)
+        page.next_cursor = (
+            encode_cursor(rows[-1], number) if rows and has_next else None
+        )
+        page.previous_cursor = (
+            encode_cursor(rows[0], number)
+            if rows and has_previous else None
+        )
+        return page
+
+
+def paginate(request, object_list):
+    """Страница ленты по параметрам запроса ?after=, ?before= или ?page=."""
+    paginator = CursorPaginator(object_list, settings.POSTS_QUANTITY)
+    return paginator.get_cursor_page(
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        page=request.GET.get('page'),
+    )
@@ -0,0 +1,272 @@
+import re
+import sqlite3
+import struct
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+from .models import Post, PostTrigram
+
+FTS_TABLE = 'posts_post_fts'
+TERM = re.compile(r'\w+')
+
+SEARCH_SQL = f'''
+    SELECT rowid, score FROM (
+        SELECT rowid, bm25({FTS_TABLE}) AS score
+        FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s
+        ORDER BY rowid DESC LIMIT %s
+    )
+    {{where}}
+    ORDER BY score {{order}}, rowid {{order}}
+    LIMIT %s
+'''
+
+
+# Столько id за раз уходит в фильтр post_id__in.
+TRIGRAM_CHUNK = 500
+# Длину списка постов триграммы считаем не дальше этого.
+TRIGRAM_COUNT_LIMIT = 10000
+# Столько триграмм запроса ищется по индексу, остальное отсеет
+# сверка с текстом.
+TRIGRAM_PROBES = 8
+
+
+@lru_cache()
+def fts5_supported():
+    """Собран ли SQLite, с которым работает Python, с модулем FTS5."""
+    probe = sqlite3.connect(':memory:')
+    try:
+        probe.execute('CREATE VIRTUAL TABLE probe USING fts5(text)')
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        probe.close()
+    return True
+
+
+def search_backend():
+    """
+    'fts5' или 'trigram': из SEARCH_BACKEND, а если он не задан —
+    FTS5 для SQLite, где он собран, и триграммы для остальных баз.
+    """
+    if settings.SEARCH_BACKEND:
+        return settings.SEARCH_BACKEND
+    if connection.vendor == 'sqlite' and fts5_supported():
+        return 'fts5'
+    return 'trigram'
+
+
+def fts_available():
+    """Индекс FTS5 создаёт миграция 0014, если SQLite его умеет."""
+    return search_backend() == 'fts5'
+
+
+def fts_query(text):
+    """
+    Запрос FTS5 из строки пользователя: все слова обязательны,
+    последнее ищется и как начало слова. Синтаксис FTS5 в строке
+    не действует: каждое слово берётся в кавычки.
+    """
+    terms = TERM.findall(text.lower())
+    if not terms:
+        return None
+    *terms, last = terms
+    return ' '.join([f'"{term}"' for term in terms] + [f'"{last}"*'])
+
+
+def matching_ids(text):
+    """Подзапрос id постов, подходящих под запрос, для фильтра pk__in."""
+    query = fts_query(text)
+    if query is None:
+        return None
+    return RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+        (query,),
+    )
+
+
+def encode_cursor(score, pk):
+    return urlsafe_base64_encode(struct.pack('>dq', score, pk))
+
+
+def decode_cursor(token):
+    """(score, id) или None для битого токена."""
+    try:
+        return struct.unpack('>dq', urlsafe_base64_decode(token))
+    except (TypeError, ValueError, struct.error):
+        return None
+
+
+class SearchPage:
+    """Страница результатов поиска с курсорами соседних страниц."""
+
+    def __init__(self, object_list, rows, has_previous, has_next):
+        self.object_list = object_list
+        self.has_previous = has_previous
+        self.has_next = has_next
+        self.previous_cursor = (
+            encode_cursor(*rows[0]) if rows and has_previous else None
+        )
+        self.next_cursor = (
+            encode_cursor(*rows[-1]) if rows and has_next else None
+        )
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def _fetch(query, cursor, reverse, limit):
+    where, params = '', [query, settings.SEARCH_RANK_LIMIT]
+    if cursor is not None:
+        where = f'WHERE (score, rowid) {"<" if reverse else ">"} (%s, %s)'
+        params += list(cursor)
+    sql = SEARCH_SQL.format(where=where, order='DESC' if reverse else 'ASC')
+    with connection.cursor() as db:
+        db.execute(sql, params + [limit + 1])
+        rows = db.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if reverse:
+        rows.reverse()
+    return rows, has_more
+
+
+def search_posts(queryset, text, per_page, after=None, before=None):
+    """
+    Страница постов queryset, подходящих под text, по убыванию
+    релевантности bm25 среди SEARCH_RANK_LIMIT самых новых совпадений.
+
+    Курсор — пара (релевантность, id) последнего показанного поста:
+    следующая страница продолжает сортировку с неё, без OFFSET.
+    """
+    query = fts_query(text)
+    if query is None:
+        return SearchPage([], [], False, False)
+    before = decode_cursor(before) if before else None
+    after = decode_cursor(after) if after and before is None else None
+    if before is not None:
+        rows, has_previous = _fetch(query, before, True, per_page)
+        has_next = True
+    else:
+        rows, has_next = _fetch(query, after, False, per_page)
+        has_previous = after is not None
+    posts = queryset.in_bulk([pk for pk, _ in rows])
+    found = [(score, pk) for pk, score in rows if pk in posts]
+    return SearchPage(
+        [posts[pk] for _, pk in found], found, has_previous, has_next
+    )
+
+
+def trigrams(text):
+    """Все подстроки из трёх символов текста без учёта регистра."""
+    text = text.casefold()
+    return {text[start:start + 3] for start in range(len(text) - 2)}
+
+
+def probe_trigrams(text):
+    """
+    Не больше TRIGRAM_PROBES разных триграмм text, взятых равномерно
+    по его длине.
+    """
+    text = text.casefold()
+    ordered = list(dict.fromkeys(
+        text[start:start + 3] for start in range(len(text) - 2)
+    ))
+    step = -(-len(ordered) // TRIGRAM_PROBES) or 1
+    return set(ordered[::step])
+
+
+def index_post(post, old_text=None):
+    """
+    Обновляет триграммы поста: удаляет пропавшие из текста
+    и добавляет новые, остальные строки индекса не трогает.
+    """
+    new, old = trigrams(post.text), trigrams(old_text or '')
+    if old - new:
+        PostTrigram.objects.filter(post=post, trigram__in=old - new).delete()
+    PostTrigram.objects.bulk_create(
+        PostTrigram(trigram=trigram, post_id=post.pk)
+        for trigram in new - old
+    )
+
+
+def trigram_search_ids(text):
+    """
+    id не более SEARCH_RANK_LIMIT самых новых постов с подстрокой text.
+
+    Список постов самой редкой триграммы читается с конца пачками,
+    каждая пачка пересекается со списками остальных триграмм и
+    сверяется с самим текстом: совпадение всех триграмм ещё не значит,
+    что они стоят подряд. Работа растёт с числом нужных результатов,
+    а не с числом постов. Длинный запрос проверяется по индексу
+    только TRIGRAM_PROBES триграммами. None, если в text меньше трёх
+    символов.
+    """
+    wanted = probe_trigrams(text)
+    if not wanted:
+        return None
+    # Точная длина частых списков не нужна, хватит знать, что они длинные.
+    sizes = {
+        trigram: PostTrigram.objects.filter(trigram=trigram)[
+            :TRIGRAM_COUNT_LIMIT
+        ].count()
+        for trigram in wanted
+    }
+    if not all(sizes.values()):
+        return []
+    smallest, *rest = sorted(wanted, key=sizes.get)
+    # Почти везде встречающиеся триграммы мало что отсеивают: такие
+    # кандидаты дешевле сразу сверить с текстом.
+    rest = [
+        trigram for trigram in rest if sizes[trigram] < TRIGRAM_COUNT_LIMIT
+    ]
+    needle = text.casefold()
+    found = []
+    postings = PostTrigram.objects.filter(trigram=smallest).order_by(
+        '-post_id'
+    ).values_list('post_id', flat=True)
+    last_id = None
+    while len(found) < settings.SEARCH_RANK_LIMIT:
+        page = postings if last_id is None else postings.filter(
+            post_id__lt=last_id
+        )
+        candidates = list(page[:TRIGRAM_CHUNK])
+        if not candidates:
+            break
+        last_id = candidates[-1]
+        for trigram in rest:
+            if not candidates:
+                break
+            candidates = PostTrigram.objects.filter(
+                trigram=trigram, post_id__in=candidates
+            ).values_list('post_id', flat=True)
+        found.extend(sorted(
+            (
+                pk for pk, body in Post.objects.filter(
+                    pk__in=list(candidates)
+                ).values_list('pk', 'text')
+                if needle in body.casefold()
+            ),
+            reverse=True,
+        ))
+    return found[:settings.SEARCH_RANK_LIMIT]
+
+
+def matching_posts(queryset, text):
+    """
+    queryset, сужённый до постов с text, через индекс текущего
+    бэкенда поиска; None, если индекс для такого запроса не годится.
+    """
+    if fts_available():
+        ids = matching_ids(text)
+    else:
+        ids = trigram_search_ids(text)
+    if ids is None:
+        return None
+    return queryset.filter(pk__in=ids)
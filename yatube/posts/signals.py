@@ -0,0 +1,142 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import autocomplete, counters, feeds, search, tags
+from .caching import (
+    post_surrogate_keys, purge_surrogate_keys, surrogate_key,
+)
+from .autocomplete import AUTOCOMPLETE_KEY
+from .models import Comment, Follow, Group, Post, User
+
+
+@receiver(pre_save, sender=Post)
+def remember_old_values(sender, instance, **kwargs):
+    instance._old_group_slug = instance._old_image = None
+    instance._old_text = None
+    # Сигнал приходит раньше, чем поле сохранит новый файл.
+    instance._image_uploaded = bool(
+        instance.image and not instance.image._committed
+    )
+    if instance.pk:
+        (
+            instance._old_group_slug, instance._old_image, instance._old_text,
+        ) = Post.objects.filter(pk=instance.pk).values_list(
+            'group__slug', 'image', 'text'
+        ).first() or (None, None, None)
+
+
+@receiver(post_save, sender=Post)
+def post_changed(sender, instance, **kwargs):
+    keys = post_surrogate_keys(instance)
+    if instance._old_group_slug is not None:
+        keys.append(surrogate_key('group', instance._old_group_slug))
+    keys.extend(
+        surrogate_key('tag', name) for name in
+        tags.hashtags(instance._old_text) - tags.hashtags(instance.text)
+    )
+    purge_surrogate_keys(*keys)
+
+
+def _delete_on_commit(image, name):
+    # Откат транзакции не должен оставить пост без файла.
+    transaction.on_commit(partial(image.storage.delete, name))
+
+
+@receiver(post_save, sender=Post)
+def release_replaced_image(sender, instance, **kwargs):
+    # Та же картинка, загруженная заново, получает то же имя, но
+    # storage.save уже добавил ей ссылку: старую надо снять.
+    if instance._old_image and (
+        instance._old_image != instance.image.name
+        or instance._image_uploaded
+    ):
+        _delete_on_commit(instance.image, instance._old_image)
+
+
+@receiver(post_save, sender=Post)
+def reindex_text(sender, instance, **kwargs):
+    # Строки индекса удалённого поста уходят каскадом.
+    if search.search_backend() != 'trigram':
+        return
+    if instance._old_text != instance.text:
+        search.index_post(instance, instance._old_text)
+
+
+@receiver(post_save, sender=Post)
+def retag(sender, instance, **kwargs):
+    # Связи удалённого поста с тегами уходят каскадом.
+    if instance._old_text != instance.text:
+        tags.update_post_tags(instance, instance._old_text)
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, **kwargs):
+    if created:
+        counters.bump_user(instance.author_id, posts_count=1)
+        feeds.forget_recent_posts(instance.author_id)
+        feeds.fan_out_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.bump_user(instance.author_id, posts_count=-1)
+    if instance.image:
+        _delete_on_commit(instance.image, instance.image.name)
+    purge_surrogate_keys(*post_surrogate_keys(instance))
+    feeds.forget_recent_posts(instance.author_id)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if created:
+        counters.bump_comments(instance.post_id, 1)
+        purge_surrogate_keys(surrogate_key('post', instance.post_id))
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.bump_comments(instance.post_id, -1)
+    purge_surrogate_keys(surrogate_key('post', instance.post_id))
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        counters.bump_user(instance.author_id, followers_count=1)
+        counters.bump_user(instance.user_id, following_count=1)
+        purge_surrogate_keys(surrogate_key('follow', instance.user_id))
+        feeds.mark_pulled(instance.author_id)
+        feeds.backfill_follow(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.bump_user(instance.author_id, followers_count=-1)
+    counters.bump_user(instance.user_id, following_count=-1)
+    purge_surrogate_keys(surrogate_key('follow', instance.user_id))
+    feeds.drop_follow(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields, **kwargs):
+    # Новое имя сразу видно в индексе этого процесса, остальные
+    # перестроят свой в фоне. Вход сохраняет только last_login,
+    # индекс подсказок не меняется.
+    if created and instance.is_active:
+        transaction.on_commit(
+            lambda: autocomplete.add_user(instance.username)
+        )
+    if created or update_fields is None or {
+        'username', 'is_active'
+    } & set(update_fields):
+        purge_surrogate_keys(AUTOCOMPLETE_KEY)
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def autocomplete_changed(sender, **kwargs):
+    purge_surrogate_keys(AUTOCOMPLETE_KEY)
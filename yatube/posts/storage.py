@@ -0,0 +1,117 @@
+import hashlib
+import os
+import posixpath
+import re
+
+from django.apps import apps
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+HASHED_NAME = re.compile(r'(?:^|/)([0-9a-f]{2})/\1[0-9a-f]{62}(\.\w+)?$')
+
+
+def file_digest(content):
+    """sha256 файла, прочитанного кусками."""
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def walk_files(path):
+    """
+    Все файлы под path, обход через os.scandir.
+
+    Генератор: в памяти только открытые каталоги текущей ветки.
+    """
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk_files(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+
+
+def hashed_name(name, hexdigest):
+    """posts/photo.JPG -> posts/ab/ab...(64 символа).jpg"""
+    directory, filename = posixpath.split(name)
+    extension = os.path.splitext(filename)[1].lower()
+    return posixpath.join(directory, hexdigest[:2], hexdigest + extension)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранит каждый уникальный файл один раз под именем из его sha256.
+
+    Повторная загрузка того же содержимого только увеличивает счётчик
+    ссылок в StoredFile, а delete() уменьшает его и удаляет файл
+    вместе с миниатюрами, когда ссылок не осталось.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = hashed_name(name, file_digest(content))
+        # Повторная загрузка обновляет mtime: collect_media не трогает
+        # свежие файлы, даже если пост с ними ещё не сохранён.
+        if not self._touch(name):
+            self._write(name, content)
+        self.add_references(name)
+        if not self.exists(name):
+            # collect_media удалил файл, пока ссылка ещё не была учтена.
+            self._write(name, content)
+        return name
+
+    def _touch(self, name):
+        """Обновляет mtime файла; False, если файла нет."""
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _write(self, name, content):
+        saved = self._save(name, content)
+        if saved != name:
+            # Тот же файл параллельно записал другой запрос.
+            super().delete(saved)
+
+    def add_references(self, name, count=1):
+        stored_file = apps.get_model('posts', 'StoredFile')
+        updated = stored_file.objects.filter(name=name).update(
+            references=F('references') + count
+        )
+        if updated:
+            return
+        try:
+            with transaction.atomic():
+                stored_file.objects.create(name=name, references=count)
+        except IntegrityError:
+            stored_file.objects.filter(name=name).update(
+                references=F('references') + count
+            )
+
+    def delete(self, name):
+        """
+        Снимает одну ссылку на файл; последняя удаляет его.
+
+        Файлы без записи в StoredFile это хранилище не создавало,
+        их оно не трогает.
+        """
+        stored_file = apps.get_model('posts', 'StoredFile')
+        if stored_file.objects.filter(name=name, references__gt=1).update(
+            references=F('references') - 1
+        ):
+            return
+        deleted, _ = stored_file.objects.filter(name=name).delete()
+        if deleted:
+            default.kvstore.delete(ImageFile(name, self))
+            super().delete(name)
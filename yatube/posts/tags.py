@@ -0,0 +1,52 @@
+import re
+
+from .models import TAG_MAX_LENGTH, PostTag, Tag
+from .paginators import QuerySetSource
+
+# Решётка внутри слова, ссылки (site.ru/#якорь) или сущности (&#39;)
+# хэштегом не считается.
+HASHTAG = re.compile(r'(?<![\w/&])#(\w+)')
+
+
+def hashtags(text):
+    """Имена хэштегов текста без # и без учёта регистра."""
+    return {
+        name.casefold() for name in HASHTAG.findall(text or '')
+        if len(name) <= TAG_MAX_LENGTH
+    }
+
+
+def update_post_tags(post, old_text=None):
+    """
+    Приводит хэштеги поста к его тексту: удаляет пропавшие
+    и добавляет новые, остальные связи не трогает.
+    """
+    new, old = hashtags(post.text), hashtags(old_text)
+    if old - new:
+        PostTag.objects.filter(post=post, tag__name__in=old - new).delete()
+    if new - old:
+        Tag.objects.bulk_create(
+            [Tag(name=name) for name in new - old], ignore_conflicts=True
+        )
+        PostTag.objects.bulk_create(
+            [
+                PostTag(tag_id=tag_id, post_id=post.pk, pub_date=post.pub_date)
+                for tag_id in Tag.objects.filter(
+                    name__in=new - old
+                ).values_list('pk', flat=True)
+            ],
+            ignore_conflicts=True,
+        )
+
+
+class TagSource(QuerySetSource):
+    """Лента хэштега: диапазонное чтение по индексу (tag, pub_date)."""
+
+    def __init__(self, tag):
+        super().__init__(
+            tag.entries.select_related('post__author', 'post__group'),
+            id_field='post_id',
+        )
+
+    def to_post(self, entry):
+        return entry.post
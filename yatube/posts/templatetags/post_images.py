@@ -0,0 +1,78 @@
+from django import template
+from django.conf import settings
+
+from posts.caching import post_surrogate_keys
+from posts.thumbnails import (
+    cached_variants, prefetch_variants, record_miss, schedule_thumbnails,
+)
+
+register = template.Library()
+
+MIME_TYPES = {
+    'WEBP': 'image/webp',
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'GIF': 'image/gif',
+}
+
+
+def _srcset(files):
+    return ', '.join(f'{thumbnail.url} {width}w' for width, thumbnail in files)
+
+
+@register.simple_tag
+def prefetch_thumbnails(posts, geometry):
+    """
+    Читает миниатюры всех постов страницы одним обращением к kvstore.
+
+    Ставится перед циклом по постам; post_picture затем берёт
+    варианты из post.thumbnail_variants и не ходит в кэш сам.
+    """
+    posts = [post for post in posts if post.image]
+    variants = prefetch_variants([post.image for post in posts], geometry)
+    for post in posts:
+        post.thumbnail_variants = {
+            **getattr(post, 'thumbnail_variants', {}),
+            geometry: variants[post.image.name],
+        }
+    return ''
+
+
+@register.inclusion_tag('posts/includes/picture.html')
+def post_picture(post, geometry):
+    """
+    <picture> с готовыми вариантами миниатюры, без ресайза в запросе.
+
+    Если вариантов ещё нет, выводит исходную картинку и ставит
+    создание миниатюр в очередь.
+    """
+    if not post.image:
+        return {}
+    prefetched = getattr(post, 'thumbnail_variants', {})
+    if geometry in prefetched:
+        variants = prefetched[geometry]
+    else:
+        variants = cached_variants(post.image, geometry)
+    if variants is None:
+        record_miss(post.image)
+        schedule_thumbnails(post.image, post_surrogate_keys(post))
+        return {
+            'src': post.image.url,
+            'width': post.width,
+            'height': post.height,
+            'placeholder': post.placeholder,
+        }
+    *sources, (fallback_format, fallback) = variants.items()
+    width, height = fallback[-1][1].size
+    return {
+        'sources': [
+            {'type': MIME_TYPES[image_format], 'srcset': _srcset(files)}
+            for image_format, files in sources
+        ],
+        'src': fallback[-1][1].url,
+        'srcset': _srcset(fallback),
+        'width': width,
+        'height': height,
+        'placeholder': post.placeholder,
+        'sizes': settings.POST_IMAGE_SIZES,
+    }
@@ -1,16 +1,49 @@
+import io
+import os
 import shutil
+import struct
 import tempfile
+import time
+import tracemalloc
+import zlib
+from http import HTTPStatus
+from types import SimpleNamespace
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase, override_settings
+from django.core.management import call_command
+from django.db import transaction
+from django.test import Client, RequestFactory, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.kvstores.cached_db_kvstore import KVStore
 
 from posts.forms import PostForm
-from posts.models import Group, Post
+from posts.management.commands.collect_media import (
+    Command as CollectMedia, referenced_images,
+)
+from posts.models import Group, Post, StoredFile
+from posts.thumbnails import (
+    cached_variants, fill_placeholder, generate_thumbnails, prefetch_variants,
+    thumbnail_misses,
+)
+from posts.tests.utils import run_on_commit_callbacks
+from posts.uploads import BoundedImageUploadHandler
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
 
 User = get_user_model()
 
@@ -173,3 +206,603 @@ class MediaTests(TestCase):
         )
 
         self.assertFormError(response, 'form', 'image', error_text)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='thumbnail_author')
+        cls.post = Post.objects.create(
+            text='Пост с картинкой',
+            author=cls.user,
+            image=SimpleUploadedFile(
+                name='thumbnail.gif',
+                content=SMALL_GIF,
+                content_type='image/gif'
+            ),
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('posts:post_detail', args=(self.post.pk,))
+
+    def test_request_never_resizes(self):
+        with mock.patch.object(
+            ThumbnailBackend, '_create_thumbnail'
+        ) as create:
+            response = self.client.get(self.url)
+        create.assert_not_called()
+        self.assertContains(response, self.post.image.url)
+        self.assertEqual(thumbnail_misses(), 1)
+        out = io.StringIO()
+        call_command('page_cache', '--reset', stdout=out)
+        self.assertIn('Отрисовок без готовой миниатюры: 1', out.getvalue())
+        self.assertEqual(thumbnail_misses(), 0)
+
+    def test_pregenerated_variants_are_rendered(self):
+        generate_thumbnails(self.post.image.name)
+        variants = cached_variants(self.post.image, 'card')
+        self.assertIsNotNone(variants)
+        jpeg = variants['JPEG']
+        self.assertEqual([width for width, _ in jpeg], [480, 720, 960])
+        self.assertEqual(jpeg[0][1].size, [480, 170])
+        response = self.client.get(self.url)
+        srcset = ', '.join(
+            f'{thumbnail.url} {width}w' for width, thumbnail in jpeg
+        )
+        self.assertContains(response, f'src="{jpeg[-1][1].url}"')
+        self.assertContains(response, f'srcset="{srcset}"')
+        self.assertContains(response, '<picture>')
+        self.assertEqual(thumbnail_misses(), 0)
+
+    @override_settings(POST_THUMBNAIL_FORMATS=('PNG', 'JPEG'))
+    def test_extra_formats_become_picture_sources(self):
+        generate_thumbnails(self.post.image.name)
+        response = self.client.get(self.url)
+        self.assertContains(response, '<source type="image/png"')
+
+    def gif_post(self, color):
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8), color).save(buffer, 'GIF')
+        return Post.objects.create(
+            text=f'Картинка {color}',
+            author=self.user,
+            image=SimpleUploadedFile(
+                name=f'{color}.gif',
+                content=buffer.getvalue(),
+                content_type='image/gif'
+            ),
+        )
+
+    def test_prefetch_reads_kvstore_once(self):
+        posts = [self.post, self.gif_post('red'), self.gif_post('blue')]
+        for post in posts:
+            generate_thumbnails(post.image.name)
+        cache.clear()
+        images = [post.image for post in posts]
+        with self.assertNumQueries(1):
+            variants = prefetch_variants(images, 'card')
+        for post in posts:
+            expected = cached_variants(post.image, 'card')
+            self.assertEqual(
+                [thumbnail.url for _, thumbnail in variants[
+                    post.image.name]['JPEG']],
+                [thumbnail.url for _, thumbnail in expected['JPEG']],
+            )
+        with self.assertNumQueries(0):
+            prefetch_variants(images, 'card')
+
+    def test_feed_page_does_no_lookup_per_post(self):
+        posts = [self.post, self.gif_post('red'), self.gif_post('blue')]
+        for post in posts:
+            generate_thumbnails(post.image.name)
+        with mock.patch.object(KVStore, '_get_raw') as get_raw:
+            response = self.client.get(reverse('posts:index'))
+        get_raw.assert_not_called()
+        self.assertContains(response, '<picture>', count=len(posts))
+        self.assertEqual(thumbnail_misses(), 0)
+
+    def test_rebuild_thumbnails_resumes_from_checkpoint(self):
+        posts = [self.post, self.gif_post('red'), self.gif_post('blue')]
+        checkpoint = os.path.join(TEMP_MEDIA_ROOT, 'rebuild.checkpoint')
+        with open(checkpoint, 'w') as saved:
+            saved.write(str(posts[0].pk))
+        out = io.StringIO()
+        call_command(
+            'rebuild_thumbnails', '--workers', '0', '--batch-size', '1',
+            '--checkpoint', checkpoint, stdout=out,
+        )
+        self.assertIn(f'Продолжаем после поста {posts[0].pk}', out.getvalue())
+        self.assertIn('/с, последний id', out.getvalue())
+        self.assertIn('миниатюры созданы для 2, ошибок: 0', out.getvalue())
+        self.assertIsNone(cached_variants(posts[0].image, 'card'))
+        for post in posts[1:]:
+            self.assertIsNotNone(cached_variants(post.image, 'card'))
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_upload_schedules_thumbnails(self):
+        client = Client()
+        client.force_login(self.user)
+        with mock.patch('posts.views.schedule_thumbnails') as schedule:
+            client.post(reverse('posts:post_create'), data={
+                'text': 'Новый пост',
+                'image': SimpleUploadedFile(
+                    name='new.gif',
+                    content=SMALL_GIF,
+                    content_type='image/gif'
+                ),
+            })
+        post = Post.objects.get(text='Новый пост')
+        schedule.assert_called_once_with(post.image, mock.ANY)
+
+
+def png_chunk(kind, data):
+    return (
+        struct.pack('>I', len(data)) + kind + data
+        + struct.pack('>I', zlib.crc32(kind + data))
+    )
+
+
+def png_bomb(width, height):
+    """PNG огромного размера: несколько килобайт сжатых нулей."""
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + png_chunk(b'IHDR', ihdr)
+        + png_chunk(b'IDAT', zlib.compress(b'\0' * 1024 * 1024))
+        + png_chunk(b'IEND', b'')
+    )
+
+
+def jpeg_bytes(size=(10, 10)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class UploadLimitTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='uploader')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def upload(self, content, name='image.jpg'):
+        return self.authorized_client.post(reverse('posts:post_create'), {
+            'text': 'Пост с картинкой',
+            'image': SimpleUploadedFile(name, content),
+        })
+
+    def test_valid_image_is_accepted(self):
+        response = self.upload(jpeg_bytes())
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        self.assertTrue(Post.objects.filter(author=self.user).exists())
+
+    @override_settings(POST_IMAGE_MAX_BYTES=100 * 1024)
+    def test_limits_reject_file_before_saving(self):
+        cases = {
+            'больше': jpeg_bytes() + b'\0' * 200 * 1024,
+            'мегапикселей': png_bomb(20000, 20000),
+            'форматы': self.bmp_bytes(),
+        }
+        for message, content in cases.items():
+            with self.subTest(message=message):
+                response = self.upload(content)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertIn(
+                    message, response.context['form'].errors['image'][0]
+                )
+        self.assertFalse(Post.objects.filter(author=self.user).exists())
+
+    def test_jpeg_with_large_icc_profile_is_accepted(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (30, 20)).save(
+            buffer, 'JPEG', icc_profile=os.urandom(100 * 1024)
+        )
+        content = buffer.getvalue()
+        # Сегменты профиля пропускаются, даже если куски файла мелкие.
+        handler = BoundedImageUploadHandler(field_names=('image',))
+        handler.new_file('image', 'photo.jpg', 'image/jpeg', len(content))
+        for start in range(0, len(content), 1000):
+            handler.receive_data_chunk(content[start:start + 1000], start)
+            if handler.checked:
+                break
+        self.assertTrue(handler.checked)
+        self.assertEqual(handler.errors, {})
+
+        response = self.upload(content)
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        post = Post.objects.get(author=self.user)
+        self.assertEqual((post.width, post.height), (30, 20))
+
+    def bmp_bytes(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(buffer, 'BMP')
+        return buffer.getvalue()
+
+    @override_settings(POST_IMAGE_MAX_BYTES=1024 * 1024)
+    def test_oversized_upload_is_not_buffered(self):
+        request = RequestFactory().post('/create/', {
+            'text': 'Пост',
+            'image': SimpleUploadedFile(
+                'big.jpg', jpeg_bytes() + b'\0' * 20 * 1024 * 1024
+            ),
+        })
+        handler = BoundedImageUploadHandler(request)
+        request.upload_handlers.insert(0, handler)
+        tracemalloc.start()
+        try:
+            files = request.FILES
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertNotIn('image', files)
+        self.assertIn('image', handler.errors)
+        self.assertLess(peak, 1024 * 1024)
+
+    def test_csrf_is_still_checked(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        response = client.post(reverse('posts:post_create'), {'text': 'x'})
+        self.assertEqual(response.status_code, HTTPStatus.FORBIDDEN)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ContentAddressedStorageTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='storage_author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def create_post(self, content, name='photo.jpg'):
+        return Post.objects.create(
+            text='Пост', author=self.user,
+            image=SimpleUploadedFile(name, content),
+        )
+
+    def test_same_content_is_stored_once(self):
+        first = self.create_post(jpeg_bytes(), 'first.JPG')
+        second = self.create_post(jpeg_bytes(), 'second.jpg')
+        storage = first.image.storage
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^posts/[0-9a-f]{2}/\w{64}\.jpg$')
+        self.assertEqual(
+            StoredFile.objects.get(name=first.image.name).references, 2
+        )
+        with run_on_commit_callbacks():
+            first.delete()
+        self.assertTrue(storage.exists(second.image.name))
+        with run_on_commit_callbacks():
+            second.delete()
+        self.assertFalse(storage.exists(second.image.name))
+        self.assertFalse(StoredFile.objects.exists())
+
+    def test_replaced_image_is_released(self):
+        post = self.create_post(jpeg_bytes())
+        old_name = post.image.name
+        post.image = SimpleUploadedFile('new.jpg', jpeg_bytes((20, 20)))
+        with run_on_commit_callbacks():
+            post.save()
+        self.assertNotEqual(post.image.name, old_name)
+        self.assertFalse(post.image.storage.exists(old_name))
+
+    def test_reupload_of_same_image_keeps_one_reference(self):
+        post = self.create_post(jpeg_bytes())
+        name = post.image.name
+        post.image = SimpleUploadedFile('again.jpg', jpeg_bytes())
+        with run_on_commit_callbacks():
+            post.save()
+        self.assertEqual(post.image.name, name)
+        self.assertEqual(StoredFile.objects.get(name=name).references, 1)
+        with run_on_commit_callbacks():
+            post.delete()
+        self.assertFalse(StoredFile.objects.filter(name=name).exists())
+        self.assertFalse(post.image.storage.exists(name))
+
+    def test_rolled_back_delete_keeps_file(self):
+        post = self.create_post(jpeg_bytes())
+        with run_on_commit_callbacks():
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    post.delete()
+                    raise RuntimeError
+        self.assertTrue(post.image.storage.exists(post.image.name))
+        self.assertEqual(
+            StoredFile.objects.get(name=post.image.name).references, 1
+        )
+
+    def test_dedupe_media_command(self):
+        storage = Post._meta.get_field('image').storage
+        names = {}
+        for name, content in (
+            ('posts/a.jpg', jpeg_bytes()),
+            ('posts/b.jpg', jpeg_bytes()),
+            ('posts/c.jpg', jpeg_bytes((20, 20))),
+        ):
+            path = storage.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as legacy:
+                legacy.write(content)
+            names[name] = Post.objects.create(text=name, author=self.user)
+            Post.objects.filter(pk=names[name].pk).update(image=name)
+
+        out = io.StringIO()
+        call_command('dedupe_media', '--dry-run', stdout=out)
+        self.assertIn('Будет перенесено: 2, дублей: 1', out.getvalue())
+        self.assertTrue(storage.exists('posts/a.jpg'))
+
+        with run_on_commit_callbacks():
+            call_command('dedupe_media', stdout=io.StringIO())
+        images = {
+            post.text: post.image.name for post in Post.objects.all()
+        }
+        self.assertEqual(images['posts/a.jpg'], images['posts/b.jpg'])
+        self.assertNotEqual(images['posts/a.jpg'], images['posts/c.jpg'])
+        for name, image in images.items():
+            self.assertFalse(storage.exists(name))
+            self.assertTrue(storage.exists(image))
+        self.assertEqual(
+            StoredFile.objects.get(name=images['posts/a.jpg']).references, 2
+        )
+
+    def test_interrupted_dedupe_keeps_old_files(self):
+        storage = Post._meta.get_field('image').storage
+        path = storage.path('posts/legacy.jpg')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as legacy:
+            legacy.write(jpeg_bytes())
+        post = Post.objects.create(text='Старый', author=self.user)
+        Post.objects.filter(pk=post.pk).update(image='posts/legacy.jpg')
+
+        with mock.patch.object(
+            type(storage), 'add_references', side_effect=RuntimeError
+        ):
+            with run_on_commit_callbacks():
+                with self.assertRaises(RuntimeError):
+                    call_command('dedupe_media', stdout=io.StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.image.name, 'posts/legacy.jpg')
+        self.assertTrue(storage.exists('posts/legacy.jpg'))
+
+        with run_on_commit_callbacks():
+            call_command('dedupe_media', stdout=io.StringIO())
+        post.refresh_from_db()
+        self.assertNotEqual(post.image.name, 'posts/legacy.jpg')
+        self.assertTrue(storage.exists(post.image.name))
+        self.assertFalse(storage.exists('posts/legacy.jpg'))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageMetadataTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='metadata_author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_form_stores_image_metadata(self):
+        content = jpeg_bytes((30, 20))
+        self.client.post(reverse('posts:post_create'), data={
+            'text': 'Пост с размерами',
+            'image': SimpleUploadedFile('photo.jpg', content),
+        })
+        post = Post.objects.get(text='Пост с размерами')
+        # Запрос читает только заголовок, заглушку создаёт задача
+        # в пуле миниатюр.
+        self.assertEqual(post.placeholder, '')
+        fill_placeholder(post.image.name)
+        post.refresh_from_db()
+        self.assertEqual(
+            (post.width, post.height, post.format, post.bytes),
+            (30, 20, 'JPEG', len(content)),
+        )
+        self.client.post(
+            reverse('posts:post_edit', args=(post.pk,)),
+            data={'text': 'Только текст'},
+        )
+        post.refresh_from_db()
+        self.assertEqual((post.width, post.height), (30, 20))
+        response = self.client.get(
+            reverse('posts:post_detail', args=(post.pk,))
+        )
+        self.assertContains(response, 'width="30" height="20"')
+        self.assertTrue(
+            post.placeholder.startswith('data:image/jpeg;base64,')
+        )
+        self.assertLess(len(post.placeholder), 1024)
+        self.assertContains(
+            response,
+            f'loading="lazy" style="background: url({post.placeholder})',
+        )
+
+    def test_backfill_command(self):
+        content = jpeg_bytes((40, 10))
+        post = Post.objects.create(
+            text='Старый пост', author=self.user,
+            image=SimpleUploadedFile('old.jpg', content),
+        )
+        missing = Post.objects.create(text='Без файла', author=self.user)
+        Post.objects.filter(pk=missing.pk).update(image='posts/lost.jpg')
+        bomb = Post.objects.create(text='Бомба', author=self.user)
+        Post.objects.filter(pk=bomb.pk).update(
+            image=Post._meta.get_field('image').storage.save(
+                'posts/bomb.png', ContentFile(png_bomb(100000, 100000))
+            )
+        )
+        self.assertIsNone(post.width)
+        out = io.StringIO()
+        call_command('backfill_image_metadata', '--workers', '1', stdout=out)
+        self.assertIn('Заполнено: 1, файлов не найдено: 2', out.getvalue())
+        post.refresh_from_db()
+        self.assertEqual(
+            (post.width, post.height, post.format, post.bytes),
+            (40, 10, 'JPEG', len(content)),
+        )
+        self.assertTrue(post.placeholder)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class CollectMediaTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='collect_author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def create_post(self, size):
+        post = Post.objects.create(
+            text='Пост', author=self.user,
+            image=SimpleUploadedFile('photo.jpg', jpeg_bytes(size)),
+        )
+        generate_thumbnails(post.image.name)
+        return post
+
+    def write_file(self, name, age):
+        path = os.path.join(TEMP_MEDIA_ROOT, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as orphan:
+            orphan.write(b'orphan')
+        os.utime(path, (time.time() - age,) * 2)
+        return path
+
+    def age_all_files(self):
+        for root, _, files in os.walk(TEMP_MEDIA_ROOT):
+            for name in files:
+                path = os.path.join(root, name)
+                os.utime(path, (time.time() - 2 * 60 * 60,) * 2)
+
+    def test_orphans_are_removed(self):
+        kept = self.create_post((10, 10))
+        dropped = self.create_post((20, 20))
+        dropped_image = dropped.image.name
+        dropped_thumbnails = [
+            thumbnail.name
+            for files in cached_variants(dropped.image, 'card').values()
+            for _, thumbnail in files
+        ]
+        # Ссылка пропала без сигналов, как после сбоя.
+        Post.objects.filter(pk=dropped.pk).update(image='')
+        self.age_all_files()
+        old = self.write_file('posts/ab/orphan.jpg', 2 * 60 * 60)
+        stale = self.write_file('cache/ab/cd/orphan.jpg', 2 * 60 * 60)
+        fresh = self.write_file('posts/ab/fresh.jpg', 0)
+        storage = kept.image.storage
+
+        out = io.StringIO()
+        call_command('collect_media', '--dry-run', stdout=out)
+        self.assertIn('Будет удалено файлов: 3', out.getvalue())
+        self.assertIn('картинках: 1', out.getvalue())
+        self.assertTrue(storage.exists(dropped_image))
+
+        out = io.StringIO()
+        call_command('collect_media', '--chunk-size', '2', stdout=out)
+        self.assertIn('Удалено файлов: 3', out.getvalue())
+        for path in (old, stale):
+            self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(fresh))
+        self.assertFalse(storage.exists(dropped_image))
+        for name in dropped_thumbnails:
+            self.assertFalse(storage.exists(name))
+        self.assertTrue(storage.exists(kept.image.name))
+        for files in cached_variants(kept.image, 'card').values():
+            for _, thumbnail in files:
+                self.assertTrue(storage.exists(thumbnail.name))
+
+    def test_outdated_thumbnails_are_removed(self):
+        post = self.create_post((50, 50))
+        old_thumbnails = [
+            thumbnail.name
+            for files in cached_variants(post.image, 'card').values()
+            for _, thumbnail in files
+        ]
+        geometries = {'card': ('200x100', {'crop': 'center'})}
+        with override_settings(
+            POST_THUMBNAILS=geometries, POST_THUMBNAIL_WIDTHS=(100,)
+        ):
+            generate_thumbnails(post.image.name)
+            self.age_all_files()
+            out = io.StringIO()
+            call_command('collect_media', stdout=out)
+            new_thumbnails = [
+                thumbnail.name
+                for files in cached_variants(post.image, 'card').values()
+                for _, thumbnail in files
+            ]
+        self.assertIn(
+            f'об устаревших миниатюрах: {len(old_thumbnails)}',
+            out.getvalue(),
+        )
+        storage = post.image.storage
+        for name in old_thumbnails:
+            self.assertFalse(storage.exists(name))
+        for name in new_thumbnails:
+            self.assertTrue(storage.exists(name))
+        self.assertTrue(storage.exists(post.image.name))
+
+    def test_reupload_refreshes_old_file(self):
+        old = self.create_post((30, 30))
+        name = old.image.name
+        Post.objects.filter(pk=old.pk).update(image='')
+        self.age_all_files()
+        # Файл загружен заново, а пост с ним ещё не сохранён.
+        storage = old.image.storage
+        storage.save(
+            'posts/again.jpg',
+            SimpleUploadedFile('again.jpg', jpeg_bytes((30, 30))),
+        )
+        call_command('collect_media', stdout=io.StringIO())
+        self.assertTrue(storage.exists(name))
+
+    def test_references_are_checked_again_before_removal(self):
+        post = self.create_post((40, 40))
+        name = post.image.name
+        self.age_all_files()
+        command = CollectMedia()
+        command.newer_than = time.time() - 60 * 60
+        entries = {name: SimpleNamespace(path=post.image.path)}
+        # Ссылка появилась после первой проверки пачки.
+        self.assertEqual(
+            command.remove({name: 1}, entries, referenced_images), {}
+        )
+        self.assertTrue(post.image.storage.exists(name))
+        Post.objects.filter(pk=post.pk).update(image='')
+        self.assertEqual(
+            command.remove({name: 1}, entries, referenced_images), {name: 1}
+        )
+        self.assertFalse(post.image.storage.exists(name))
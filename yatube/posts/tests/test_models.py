@@ -1,7 +1,11 @@
+from io import StringIO
+
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.management import call_command
+from django.test import Client, TestCase
+from django.urls import reverse
 
-from posts.models import Group, Post
+from posts.models import Comment, Follow, Group, Post, UserStats
 
 from ..models import Group, Post
 
@@ -39,3 +43,111 @@ class PostModelTest(TestCase):
                     result,
                     'Функция str в модели Post работает неверно'
                 )
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(username='writer')
+
+    def test_counters_follow_creates_and_deletes(self):
+        post = Post.objects.create(author=self.author, text='Текст')
+        Comment.objects.create(author=self.user, post=post, text='Коммент')
+        follow = Follow.objects.create(user=self.user, author=self.author)
+
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        stats = UserStats.objects.get(user=self.author)
+        self.assertEqual(stats.posts_count, 1)
+        self.assertEqual(stats.followers_count, 1)
+        self.assertEqual(
+            UserStats.objects.get(user=self.user).following_count, 1)
+
+        follow.delete()
+        post.delete()
+        stats.refresh_from_db()
+        self.assertEqual(stats.posts_count, 0)
+        self.assertEqual(stats.followers_count, 0)
+
+    def test_edit_after_comment_keeps_counter(self):
+        post = Post.objects.create(author=self.author, text='Текст')
+        client = Client()
+        client.force_login(self.author)
+        # Пост уже прочитан представлением, когда приходит комментарий.
+        loaded = Post.objects.get(pk=post.pk)
+        Comment.objects.create(author=self.user, post=post, text='Коммент')
+        loaded.text = 'Правка'
+        loaded.save()
+
+        client.post(
+            reverse('posts:post_edit', args=(post.pk,)),
+            {'text': 'Ещё правка'},
+        )
+
+        post.refresh_from_db()
+        self.assertEqual(post.text, 'Ещё правка')
+        self.assertEqual(post.comments_count, 1)
+
+    def test_repair_counters_fixes_drift(self):
+        post = Post.objects.create(author=self.author, text='Текст')
+        UserStats.objects.filter(user=self.author).update(posts_count=42)
+        Post.objects.filter(pk=post.pk).update(comments_count=7)
+
+        call_command('repair_counters', '--workers=1', stdout=StringIO())
+
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).posts_count, 1)
+
+
+class FeedIndexesTest(TestCase):
+    def test_feed_queries_are_ordered_by_index(self):
+        """Ни один запрос лент не сортирует через временное B-дерево."""
+        out = StringIO()
+        call_command('explain_feeds', '--strict', stdout=out)
+        self.assertIn('post_group_date_idx', out.getvalue())
+
+
+class RenderedTextTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='renderer')
+
+    def test_save_renders_text(self):
+        post = Post.objects.create(
+            author=self.author,
+            text='Первая <b>строка</b>\nвторая строка длинного поста',
+        )
+
+        post.refresh_from_db()
+        self.assertEqual(
+            post.text_html,
+            'Первая &lt;b&gt;строка&lt;/b&gt;<br>'
+            'вторая строка длинного поста',
+        )
+        self.assertEqual(post.title_snippet, 'Первая <b>строка</b>\nвторая с…')
+
+    def test_save_with_update_fields_keeps_html_in_step(self):
+        post = Post.objects.create(author=self.author, text='Старый')
+        post.text = 'Новый'
+        post.save(update_fields=['text'])
+
+        post.refresh_from_db()
+        self.assertEqual(post.text_html, 'Новый')
+        self.assertEqual(post.title_snippet, 'Новый')
+
+    def test_backfill_post_html(self):
+        post = Post.objects.create(author=self.author, text='Раз\nдва')
+        Post.objects.filter(pk=post.pk).update(
+            text_html='', title_snippet=''
+        )
+
+        call_command('backfill_post_html', '--workers=1', stdout=StringIO())
+
+        post.refresh_from_db()
+        self.assertEqual(post.text_html, 'Раз<br>два')
+        self.assertEqual(post.title_snippet, 'Раз\nдва')
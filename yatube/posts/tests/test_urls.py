@@ -1,5 +1,9 @@
+from http import HTTPStatus
+
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.core.exceptions import PermissionDenied
+from django.test import Client, RequestFactory, TestCase
+from django.urls import get_resolver
 
 from posts.models import Group, Post
 
@@ -100,3 +104,13 @@ class PostsURLTests(TestCase):
             with self.subTest(address=address):
                 response = self.authorized_client.get(address)
                 self.assertTemplateUsed(response, template)
+
+    def test_permission_denied_uses_403_handler(self):
+        """Django вызывает handler403 с аргументом exception."""
+        handler, _ = get_resolver().resolve_error_handler(
+            HTTPStatus.FORBIDDEN
+        )
+        response = handler(
+            RequestFactory().get('/'), exception=PermissionDenied()
+        )
+        self.assertEqual(response.status_code, HTTPStatus.FORBIDDEN)
@@ -1,13 +1,38 @@
+import os
+import shutil
+import tempfile
 from http import HTTPStatus
+from io import StringIO
+from unittest import mock
 
 from django import forms
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
+from django.core.management import call_command
+from django.db import connection
+from django.test import (
+    Client, SimpleTestCase, TestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import urlsafe_base64_encode
 
-from posts.models import Comment, Follow, Group, Post
+from posts import feeds
+from posts.autocomplete import PrefixIndex
+from posts.caching import page_cache_stats
+from posts.models import (
+    Comment, Follow, Group, Post, PostTag, PostTrigram, Tag, TimelineEntry,
+    UserStats,
+)
+from posts.paginators import CursorPaginator
+from posts.search import (
+    TRIGRAM_PROBES, search_backend, trigram_search_ids, trigrams,
+)
+from posts.tags import hashtags
+from posts.tests.utils import run_on_commit_callbacks
 
 User = get_user_model()
 
@@ -174,6 +199,11 @@ class ViewTests(TestCase):
             'page_obj').object_list[0], post_2)
 
     def test_correct_image_context(self):
+        media_root = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        self.addCleanup(shutil.rmtree, media_root, True)
+        media = self.settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
         small_gif = (
             b'\x47\x49\x46\x38\x39\x61\x02\x00'
             b'\x01\x00\x80\x00\x00\x00\x00\x00'
@@ -228,30 +258,57 @@ class ViewTests(TestCase):
         self.assertEqual(response.status_code, HTTPStatus.OK)
         self.assertContains(response, comment.text)
 
+    def test_pages_output_stored_html(self):
+        post = Post.objects.create(text='Строка\nещё', author=self.user_1)
+        Post.objects.filter(pk=post.pk).update(
+            text_html='<i>готовый</i>', title_snippet='Готовый заголовок'
+        )
+
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, '<p><i>готовый</i></p>', html=True)
+        response = self.authorized_client.get(
+            reverse('posts:post_detail', args=(post.pk,))
+        )
+        self.assertContains(response, 'Пост Готовый заголовок')
+
     def test_cache(self):
         index = reverse('posts:index')
 
         post_two = Post.objects.create(
-            text='Кэирование',
+            text='Кэширование',
             author=self.user_1
         )
 
-        response_clear = self.authorized_client.get(index)
-        post_two.delete()
+        self.authorized_client.get(index)
+        Post.objects.filter(pk=post_two.pk).update(text='Без сигнала')
         response_cache = self.authorized_client.get(index)
+        self.assertContains(response_cache, 'Кэширование')
 
-        self.assertEqual(
-            response_clear.content,
-            response_cache.content
-        )
-
-        cache.clear()
+        post_two.delete()
         response_without = self.authorized_client.get(index)
+        self.assertNotContains(response_without, 'Кэширование')
+
+    def test_feeds_do_not_share_cached_fragments(self):
+        author = User.objects.create(username='author')
+        Post.objects.create(text='Пост в избранном', author=author)
+        self.authorized_client.get(reverse('posts:index'))
 
-        self.assertNotEqual(
-            response_clear.content,
-            response_without.content
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertNotContains(response, 'Пост в избранном')
+
+    def test_edited_post_leaves_old_group_cache(self):
+        post = Post.objects.create(
+            text='Пост сменит группу',
+            author=self.user_1,
+            group=self.group,
         )
+        group_url = reverse('posts:group_list', args=(self.group.slug,))
+        self.authorized_client.get(group_url)
+
+        post.group = None
+        post.save()
+        response = self.authorized_client.get(group_url)
+        self.assertNotContains(response, post.text)
 
 
 class PaginatorTests(TestCase):
@@ -302,6 +359,67 @@ class PaginatorTests(TestCase):
                 response = self.client_2.get(reversed_name + '?page=2')
                 self.assertEqual(len(response.context['page_obj']), 3)
 
+    def test_cursor_pages_follow_each_other(self):
+        url = reverse('posts:index')
+        first_page = self.client_2.get(url).context['page_obj']
+        self.assertIsNone(first_page.previous_cursor)
+
+        response = self.client_2.get(
+            url, {'after': first_page.next_cursor})
+        second_page = response.context['page_obj']
+        self.assertEqual(second_page.number, 2)
+        self.assertFalse(second_page.has_next())
+        self.assertEqual(
+            list(second_page),
+            list(Post.objects.order_by('-pub_date', '-id')[10:])
+        )
+
+        response = self.client_2.get(
+            url, {'before': second_page.previous_cursor})
+        self.assertEqual(response.context['page_obj'].number, 1)
+        self.assertEqual(list(response.context['page_obj']), list(first_page))
+
+    def test_page_links_are_windowed(self):
+        paginator = CursorPaginator(Post.objects.all(), 1)
+        page = paginator.get_cursor_page(page=7)
+        self.assertEqual(
+            list(page.page_links()),
+            [1, '…', 5, 6, 7, 8, 9, '…', 13]
+        )
+
+    def test_page_links_rendered_without_full_range(self):
+        response = self.client_2.get(reverse('posts:index'), {'page': 2})
+        self.assertContains(response, '?page=1')
+        self.assertNotContains(response, '?page=3')
+
+    def test_broken_cursor_falls_back_to_first_page(self):
+        response = self.client_2.get(
+            reverse('posts:index'), {'after': 'не-токен'})
+        self.assertEqual(response.context['page_obj'].number, 1)
+        self.assertEqual(len(response.context['page_obj']), 10)
+
+    def test_forged_cursor_falls_back_to_first_page(self):
+        pub_date = timezone.now().isoformat()
+        for raw in (
+            f'{pub_date}|{10 ** 30}|1',
+            f'{pub_date}|1|{10 ** 30}',
+            f'{pub_date}|1|0',
+        ):
+            token = urlsafe_base64_encode(raw.encode())
+            for param in ('after', 'before'):
+                with self.subTest(raw=raw, param=param):
+                    response = self.client_2.get(
+                        reverse('posts:index'), {param: token})
+                    self.assertEqual(response.status_code, HTTPStatus.OK)
+                    self.assertEqual(response.context['page_obj'].number, 1)
+
+    def test_huge_page_number_returns_last_page(self):
+        response = self.client_2.get(
+            reverse('posts:index'), {'page': '1' + '0' * 23})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.context['page_obj'].number, 2)
+        self.assertEqual(len(response.context['page_obj']), 3)
+
 
 class SubsTest(TestCase):
     @classmethod
@@ -384,3 +502,853 @@ class SubsTest(TestCase):
         response = self.authorized_client.get(url)
         subscribe_posts = response.context.get('page_obj').object_list
         self.assertIn(post, subscribe_posts)
+
+    def test_timeline_follows_posts_and_unfollow(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(text='Тестовый текст', author=self.author)
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=self.user, post=post).exists()
+        )
+
+        self.authorized_client.get(reverse(
+            'posts:profile_unfollow',
+            kwargs={'username': self.author.username}
+        ))
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+
+    def test_deleted_post_leaves_timeline(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(text='Тестовый текст', author=self.author)
+        post.delete()
+
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertEqual(len(response.context['page_obj']), 0)
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+
+
+@override_settings(FEED_FAN_OUT_THRESHOLD=1)
+class HybridFeedTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create(username='reader')
+        cls.other_reader = User.objects.create(username='other_reader')
+        cls.star = User.objects.create(username='star')
+        cls.author = User.objects.create(username='author')
+
+    def setUp(self):
+        cache.clear()
+        Follow.objects.create(user=self.other_reader, author=self.star)
+        Follow.objects.create(user=self.reader, author=self.star)
+        Follow.objects.create(user=self.reader, author=self.author)
+        cache.clear()
+        self.client_reader = Client()
+        self.client_reader.force_login(self.reader)
+
+    def test_popular_author_is_pulled_not_pushed(self):
+        post = Post.objects.create(text='Пост звезды', author=self.star)
+        self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+
+        response = self.client_reader.get(reverse('posts:follow_index'))
+        self.assertIn(post, response.context['page_obj'].object_list)
+
+    def test_pushed_and_pulled_posts_are_merged_in_order(self):
+        for number in range(7):
+            Post.objects.create(text=f'Звезда {number}', author=self.star)
+            Post.objects.create(text=f'Автор {number}', author=self.author)
+        expected = list(Post.objects.order_by('-pub_date', '-id'))
+
+        url = reverse('posts:follow_index')
+        first_page = self.client_reader.get(url).context['page_obj']
+        second_page = self.client_reader.get(
+            url, {'after': first_page.next_cursor}).context['page_obj']
+
+        self.assertEqual(list(first_page), expected[:10])
+        self.assertEqual(list(second_page), expected[10:])
+        self.assertFalse(second_page.has_next())
+
+    def test_pulled_posts_survive_dropping_below_threshold(self):
+        post = Post.objects.create(text='Пост звезды', author=self.star)
+        Follow.objects.get(user=self.other_reader, author=self.star).delete()
+        url = reverse('posts:follow_index')
+
+        # Автор дочитывается, пока его посты не разложены по лентам.
+        response = self.client_reader.get(url)
+        self.assertIn(post, response.context['page_obj'].object_list)
+
+        call_command('settle_pulled_authors', stdout=StringIO())
+
+        self.assertFalse(UserStats.objects.get(user=self.star).pulled)
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=self.reader, post=post).exists()
+        )
+        cache.clear()
+        response = self.client_reader.get(url)
+        self.assertIn(post, response.context['page_obj'].object_list)
+        new_post = Post.objects.create(text='Снова в лентах', author=self.star)
+        self.assertTrue(
+            TimelineEntry.objects.filter(post=new_post).exists()
+        )
+
+    def test_recent_posts_are_cached_briefly(self):
+        post = Post.objects.create(text='Пост звезды', author=self.star)
+        with mock.patch('posts.feeds.cache') as fake_cache:
+            fake_cache.get_many.return_value = {}
+            keys = feeds.recent_post_keys([self.star.pk])
+        self.assertEqual(keys, {self.star.pk: [(post.pub_date, post.pk)]})
+        fake_cache.set_many.assert_called_once_with(
+            {feeds.RECENT_POSTS_KEY.format(self.star.pk): keys[self.star.pk]},
+            feeds.RECENT_POSTS_TTL,
+        )
+
+    def test_uncached_authors_are_fetched_in_one_query(self):
+        for number in range(3):
+            Post.objects.create(text=f'Звезда {number}', author=self.star)
+            Post.objects.create(text=f'Автор {number}', author=self.author)
+        author_ids = [self.star.pk, self.author.pk, self.reader.pk]
+        with mock.patch.object(feeds, 'RECENT_POSTS_LIMIT', 2):
+            with self.assertNumQueries(1):
+                keys = feeds.recent_post_keys(author_ids)
+        for author in (self.star, self.author):
+            self.assertEqual(
+                keys[author.pk],
+                list(author.posts.order_by('-pub_date', '-id').values_list(
+                    'pub_date', 'id'
+                )[:2]),
+            )
+        self.assertEqual(keys[self.reader.pk], [])
+        with self.assertNumQueries(0):
+            self.assertEqual(feeds.recent_post_keys(author_ids), keys)
+
+    @override_settings(FEED_BACKFILL_POSTS=2)
+    def test_follow_backfills_only_recent_posts(self):
+        newcomer = User.objects.create(username='newcomer')
+        posts = [
+            Post.objects.create(text=f'Пост {number}', author=newcomer)
+            for number in range(3)
+        ]
+
+        Follow.objects.create(user=self.reader, author=newcomer)
+
+        self.assertEqual(
+            set(TimelineEntry.objects.filter(
+                user=self.reader, author=newcomer
+            ).values_list('post_id', flat=True)),
+            {posts[1].pk, posts[2].pk},
+        )
+
+
+class QueryBudgetTests(TestCase):
+    """Число запросов страницы не растёт вместе с числом постов."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create(username='reader')
+        cls.author = User.objects.create(username='author')
+        cls.group = Group.objects.create(
+            title='Название',
+            slug='budget-slug',
+            description='Описание',
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        for number in range(12):
+            Post.objects.create(
+                text=f'Текст поста {number}',
+                author=cls.author,
+                group=cls.group,
+            )
+        cls.post = Post.objects.first()
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def assertQueriesWithin(self, budget, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.reader_client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertLessEqual(
+            len(queries), budget,
+            '\n'.join(query['sql'] for query in queries.captured_queries)
+        )
+
+    def test_feed_query_budgets(self):
+        # В бюджет лент входит COUNT(*) для ссылок пагинатора: в работе
+        # он кэшируется, но здесь кэш очищается перед каждым запросом.
+        # Ещё один запрос — валидатор для условного GET.
+        budgets = {
+            reverse('posts:index'): 5,
+            reverse('posts:group_list', args=(self.group.slug,)): 6,
+            reverse('posts:profile', args=(self.author.username,)): 7,
+            reverse('posts:follow_index'): 6,
+            reverse('posts:post_detail', args=(self.post.pk,)): 5,
+        }
+        for url, budget in budgets.items():
+            with self.subTest(url=url):
+                self.assertQueriesWithin(budget, url)
+
+
+class PageCacheTests(TestCase):
+    """Страницы для анонимов кэшируются и сбрасываются по ключам."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='page_author')
+        cls.group = Group.objects.create(
+            title='Название',
+            slug='page-slug',
+            description='Описание',
+        )
+        cls.post = Post.objects.create(
+            text='Текст поста',
+            author=cls.author,
+            group=cls.group,
+        )
+        cls.other_post = Post.objects.create(
+            text='Пост без группы',
+            author=User.objects.create(username='other_author'),
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+
+    def test_anonymous_page_is_cached(self):
+        url = reverse('posts:index')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        # Валидатор условного GET тоже берётся из кеша.
+        self.assertEqual(len(queries), 0)
+        self.assertIn('posts', response['Surrogate-Key'].split())
+
+    def test_authorized_and_no_cache_requests_bypass_cache(self):
+        url = reverse('posts:index')
+        self.client.get(url)
+        response = self.author_client.get(url)
+        self.assertNotIn('X-Cache', response)
+        response = self.client.get(url, HTTP_CACHE_CONTROL='no-cache')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        with override_settings(PAGE_CACHE_ENABLED=False):
+            self.assertNotIn('X-Cache', self.client.get(url))
+
+    def test_edit_purges_only_affected_pages(self):
+        post_url = reverse('posts:post_detail', args=(self.post.pk,))
+        other_url = reverse('posts:post_detail', args=(self.other_post.pk,))
+        group_url = reverse('posts:group_list', args=(self.group.slug,))
+        for url in (post_url, other_url, group_url):
+            self.client.get(url)
+        self.author_client.post(
+            reverse('posts:post_edit', args=(self.post.pk,)),
+            data={'text': 'Новый текст', 'group': self.group.pk},
+        )
+        response = self.client.get(post_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'Новый текст')
+        self.assertEqual(self.client.get(group_url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(other_url)['X-Cache'], 'HIT')
+
+    def test_comment_purges_post_page(self):
+        url = reverse('posts:post_detail', args=(self.post.pk,))
+        self.client.get(url)
+        self.author_client.post(
+            reverse('posts:add_comment', args=(self.post.pk,)),
+            data={'text': 'Комментарий'},
+        )
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'Комментарий')
+
+    def test_page_cache_command_reports_hit_ratio(self):
+        url = reverse('posts:index')
+        self.client.get(url)
+        self.client.get(url)
+        out = StringIO()
+        call_command('page_cache', '--reset', stdout=out)
+        self.assertIn('Попаданий: 1, промахов: 1, доля: 50.0%', out.getvalue())
+        self.assertEqual(page_cache_stats(), (0, 0))
+
+
+class ConditionalGetTests(TestCase):
+    """Неизменившиеся страницы отдаются как 304 без отрисовки шаблона."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='etag_author')
+        cls.group = Group.objects.create(
+            title='Название',
+            slug='etag-slug',
+            description='Описание',
+        )
+        cls.post = Post.objects.create(
+            text='Текст поста',
+            author=cls.author,
+            group=cls.group,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+
+    def test_unchanged_pages_are_not_modified(self):
+        # Списочные страницы берут валидатор из кеша, пост — из базы.
+        urls = {
+            reverse('posts:index'): 0,
+            reverse('posts:group_list', args=(self.group.slug,)): 0,
+            reverse('posts:profile', args=(self.author.username,)): 0,
+            reverse('posts:post_detail', args=(self.post.pk,)): 1,
+        }
+        for url, expected_queries in urls.items():
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(
+                    response.status_code, HTTPStatus.NOT_MODIFIED
+                )
+                self.assertEqual(response.templates, [])
+                self.assertEqual(len(queries), expected_queries)
+
+    def test_if_modified_since(self):
+        url = reverse('posts:index')
+        last_modified = self.client.get(url)['Last-Modified']
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_changes_invalidate_validators(self):
+        index_url = reverse('posts:index')
+        detail_url = reverse('posts:post_detail', args=(self.post.pk,))
+        index_etag = self.client.get(index_url)['ETag']
+        detail_etag = self.client.get(detail_url)['ETag']
+        Post.objects.create(text='Новый пост', author=self.author)
+        Comment.objects.create(
+            post=self.post, author=self.author, text='Комментарий'
+        )
+        for url, etag in ((index_url, index_etag), (detail_url, detail_etag)):
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_etag_depends_on_user(self):
+        url = reverse('posts:index')
+        etag = self.client.get(url)['ETag']
+        response = self.author_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        follow_url = reverse('posts:follow_index')
+        etag = self.author_client.get(follow_url)['ETag']
+        response = self.author_client.get(
+            follow_url, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_etag_depends_on_csrf_cookie(self):
+        url = reverse('posts:post_detail', args=(self.post.pk,))
+        response = self.author_client.get(url)
+        etag = response['ETag']
+        self.author_client.logout()
+        self.author_client.force_login(self.author)
+        self.author_client.cookies[settings.CSRF_COOKIE_NAME] = 'rotated'
+        response = self.author_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+class MediaServingTests(SimpleTestCase):
+    content = bytes(range(256)) * 4
+    hashed = 'posts/ab/ab' + '0' * 62 + '.jpg'
+    thumbnail = 'cache/ab/cd/abcd' + '0' * 28 + '.webp'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        for name in ('posts/a b.jpg', cls.hashed, cls.thumbnail):
+            path = os.path.join(cls.media_root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(cls.content)
+        cls.override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.url = reverse('media', args=('posts/a b.jpg',))
+
+    def test_file_is_streamed_with_cache_headers(self):
+        for name in (self.hashed, self.thumbnail):
+            with self.subTest(name=name):
+                url = reverse('media', args=(name,))
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertEqual(
+                    b''.join(response.streaming_content), self.content
+                )
+                self.assertEqual(
+                    response['Content-Length'], str(len(self.content))
+                )
+                self.assertEqual(response['Accept-Ranges'], 'bytes')
+                self.assertIn('max-age=31536000', response['Cache-Control'])
+                self.assertIn('immutable', response['Cache-Control'])
+                self.assertIn('Expires', response)
+                response = self.client.get(url, HTTP_RANGE='bytes=0-9')
+                self.assertIn('immutable', response['Cache-Control'])
+                not_modified = self.client.get(
+                    url, HTTP_IF_NONE_MATCH=response['ETag']
+                )
+                self.assertEqual(
+                    not_modified.status_code, HTTPStatus.NOT_MODIFIED
+                )
+
+    def test_legacy_names_and_errors_are_not_cached(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('ETag', response)
+        self.assertNotIn('Cache-Control', response)
+        self.assertNotIn('Expires', response)
+        response = self.client.get(
+            reverse('media', args=(self.hashed,)), HTTP_RANGE='bytes=5000-'
+        )
+        self.assertEqual(
+            response.status_code, HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE
+        )
+        self.assertNotIn('Cache-Control', response)
+        self.assertNotIn('Expires', response)
+
+    def test_range_requests(self):
+        size = len(self.content)
+        for header, start, end in (
+            ('bytes=10-19', 10, 19),
+            ('bytes=1000-', 1000, size - 1),
+            ('bytes=-4', size - 4, size - 1),
+            ('bytes=1020-5000', 1020, size - 1),
+        ):
+            with self.subTest(header=header):
+                response = self.client.get(self.url, HTTP_RANGE=header)
+                self.assertEqual(
+                    response.status_code, HTTPStatus.PARTIAL_CONTENT
+                )
+                self.assertEqual(
+                    response['Content-Range'], f'bytes {start}-{end}/{size}'
+                )
+                self.assertEqual(
+                    b''.join(response.streaming_content),
+                    self.content[start:end + 1],
+                )
+        response = self.client.get(self.url, HTTP_RANGE='bytes=5000-')
+        self.assertEqual(
+            response.status_code, HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE
+        )
+        self.assertEqual(response['Content-Range'], f'bytes */{size}')
+
+    def test_stale_if_range_returns_whole_file(self):
+        response = self.client.get(
+            self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_missing_and_outside_files(self):
+        for path in ('posts/none.jpg', 'posts', '../settings.py'):
+            with self.subTest(path=path):
+                response = self.client.get(reverse('media', args=(path,)))
+                self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    @override_settings(MEDIA_SENDFILE='nginx')
+    def test_nginx_accel_redirect(self):
+        response = self.client.get(self.url)
+        self.assertEqual(
+            response['X-Accel-Redirect'], '/protected-media/posts/a%20b.jpg'
+        )
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        response = self.client.get(reverse('media', args=(self.hashed,)))
+        self.assertIn('immutable', response['Cache-Control'])
+
+    @override_settings(MEDIA_SENDFILE='sendfile')
+    def test_x_sendfile(self):
+        response = self.client.get(self.url)
+        self.assertEqual(
+            response['X-Sendfile'],
+            os.path.join(self.media_root, 'posts', 'a b.jpg'),
+        )
+        self.assertEqual(response.content, b'')
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='searcher')
+        cls.cat = Post.objects.create(
+            text='Кот спит, кот ест, кот гуляет', author=cls.user
+        )
+        cls.cats = Post.objects.create(
+            text='Кот и кошка дружат', author=cls.user
+        )
+        cls.dog = Post.objects.create(text='Собака лает', author=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, query, **params):
+        response = self.client.get(
+            reverse('posts:search'), {'q': query, **params}
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return response
+
+    def test_search_pages_are_not_cached(self):
+        for query in ('кот', 'собака'):
+            with self.subTest(query=query):
+                self.assertNotIn('X-Cache', self.search(query))
+        self.assertEqual(page_cache_stats(), (0, 0))
+
+    def test_fts_triggers_survive_migrations(self):
+        """
+        SQLite пересоздаёт posts_post почти при любом изменении полей
+        и теряет триггеры; миграция, которая это делает, должна их
+        вернуть.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name FROM sqlite_master "
+                "WHERE type = 'trigger' AND tbl_name = 'posts_post'"
+            )
+            triggers = {name for name, in cursor.fetchall()}
+        self.assertLessEqual(
+            {
+                'posts_post_fts_insert',
+                'posts_post_fts_delete',
+                'posts_post_fts_update',
+            },
+            triggers,
+        )
+
+    def test_results_are_ranked(self):
+        page = self.search('кот').context['page_obj']
+        self.assertEqual(list(page), [self.cat, self.cats])
+
+    def test_last_word_matches_prefix(self):
+        page = self.search('кот кош').context['page_obj']
+        self.assertEqual(list(page), [self.cats])
+
+    def test_index_follows_edits_and_deletes(self):
+        dog = Post.objects.get(pk=self.dog.pk)
+        dog.text = 'Собака и кот'
+        dog.save()
+        self.assertIn(dog, self.search('кот').context['page_obj'])
+        self.assertNotIn(dog, self.search('лает').context['page_obj'])
+        Post.objects.get(pk=self.cat.pk).delete()
+        self.assertEqual(
+            list(self.search('спит').context['page_obj']), []
+        )
+
+    def test_query_syntax_is_not_interpreted(self):
+        for query in ('"', 'кот AND (', 'NEAR(кот', '*', 'кот OR собака'):
+            with self.subTest(query=query):
+                self.search(query)
+        self.assertContains(self.search('-'), 'Поиск по постам')
+
+    def test_cursor_pagination(self):
+        Post.objects.bulk_create(
+            Post(text=f'Рыба номер {number}', author=self.user)
+            for number in range(settings.POSTS_QUANTITY + 5)
+        )
+        first = self.search('рыба').context['page_obj']
+        self.assertEqual(len(first), settings.POSTS_QUANTITY)
+        self.assertFalse(first.has_previous)
+        second = self.search(
+            'рыба', after=first.next_cursor
+        ).context['page_obj']
+        self.assertEqual(len(second), 5)
+        self.assertFalse(second.has_next)
+        self.assertFalse(set(first) & set(second))
+        back = self.search(
+            'рыба', before=second.previous_cursor
+        ).context['page_obj']
+        self.assertEqual(list(back), list(first))
+
+    def test_admin_search_uses_index(self):
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password'
+        )
+        self.client.force_login(admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('admin:posts_post_changelist'), {'q': 'кошка'}
+            )
+        self.assertEqual(
+            list(response.context['cl'].result_list), [self.cats]
+        )
+        sql = ' '.join(query['sql'] for query in queries)
+        self.assertIn('posts_post_fts', sql)
+        self.assertNotIn('LIKE', sql)
+
+
+@override_settings(SEARCH_BACKEND='trigram')
+class TrigramSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='trigram_searcher')
+
+    def setUp(self):
+        cache.clear()
+
+    def create(self, text):
+        return Post.objects.create(text=text, author=self.user)
+
+    def search(self, query):
+        response = self.client.get(reverse('posts:search'), {'q': query})
+        return list(response.context['page_obj'])
+
+    def indexed(self, post):
+        return set(
+            PostTrigram.objects.filter(post=post).values_list(
+                'trigram', flat=True
+            )
+        )
+
+    def test_default_backend_is_fts5_on_this_sqlite(self):
+        with override_settings(SEARCH_BACKEND=None):
+            self.assertEqual(search_backend(), 'fts5')
+
+    def test_substring_search(self):
+        cat = self.create('Кошка спит')
+        dog = self.create('Собака лает на кошку')
+        self.create('Попугай молчит')
+        self.assertEqual(self.search('ОШК'), [dog, cat])
+        self.assertEqual(self.search('лает на'), [dog])
+        self.assertEqual(self.search('жираф'), [])
+
+    def test_candidates_are_verified(self):
+        self.create('абв бвб вба')
+        self.assertEqual(self.search('абвба'), [])
+
+    def test_long_query_probes_few_trigrams(self):
+        text = ''.join(chr(code) for code in range(0x400, 0x400 + 500))
+        post = self.create(text)
+        self.create(text[:250])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(trigram_search_ids(text), [post.pk])
+        self.assertLessEqual(len(queries), 2 * TRIGRAM_PROBES + 2)
+
+    def test_short_query_scans_text(self):
+        post = self.create('ёж')
+        self.assertEqual(self.search('ёж'), [post])
+
+    def test_index_follows_edits_and_deletes(self):
+        post = self.create('Кот спит')
+        self.assertEqual(self.indexed(post), trigrams('Кот спит'))
+        post.text = 'Кот ест'
+        post.save()
+        self.assertEqual(self.indexed(post), trigrams('Кот ест'))
+        self.assertEqual(self.search('спит'), [])
+        self.assertEqual(self.search('ест'), [post])
+        post.delete()
+        self.assertFalse(PostTrigram.objects.exists())
+
+    def test_build_trigram_index(self):
+        Post.objects.bulk_create(
+            Post(text=f'Рыба номер {number}', author=self.user)
+            for number in range(5)
+        )
+        self.assertEqual(self.search('рыба'), [])
+        call_command(
+            'build_trigram_index', '--chunk-size', '2', stdout=StringIO()
+        )
+        self.assertEqual(len(self.search('рыба')), 5)
+        self.assertEqual(len(self.search('номер 3')), 1)
+
+
+class TagTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='tagger')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def create(self, text):
+        return Post.objects.create(text=text, author=self.user)
+
+    def tag_names(self, post):
+        return set(
+            PostTag.objects.filter(post=post).values_list(
+                'tag__name', flat=True
+            )
+        )
+
+    def test_hashtags(self):
+        self.assertEqual(
+            hashtags('#Кот и #кот, #собака_2 site.ru/#якорь ##еж'),
+            {'кот', 'собака_2', 'еж'},
+        )
+
+    def test_tag_feed(self):
+        cat = self.create('Мой #кот')
+        dog = self.create('#Кот и #собака')
+        self.create('Без тегов')
+
+        response = self.client.get(reverse('posts:tag_list', args=('кот',)))
+        self.assertEqual(list(response.context['page_obj']), [dog, cat])
+        self.assertTemplateUsed(response, 'includes/post_card.html')
+        response = self.client.get(reverse('posts:tag_list', args=('нет',)))
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_tag_feed_pages_by_cursor(self):
+        posts = [
+            self.create(f'#лента {number}')
+            for number in range(settings.POSTS_QUANTITY + 3)
+        ]
+        url = reverse('posts:tag_list', args=('лента',))
+
+        first = self.client.get(url).context['page_obj']
+        second = self.client.get(
+            url, {'after': first.next_cursor}
+        ).context['page_obj']
+        self.assertEqual(
+            list(first) + list(second), posts[::-1]
+        )
+
+    def test_edit_diffs_tags(self):
+        post = self.create('#кот и #собака')
+        kept = PostTag.objects.get(post=post, tag__name='кот')
+
+        self.client.post(
+            reverse('posts:post_edit', args=(post.pk,)),
+            {'text': '#кот и #попугай'},
+        )
+
+        self.assertEqual(self.tag_names(post), {'кот', 'попугай'})
+        self.assertTrue(PostTag.objects.filter(pk=kept.pk).exists())
+        self.assertEqual(PostTag.objects.get(pk=kept.pk).pub_date,
+                         post.pub_date)
+
+    def test_edit_purges_old_tag_page(self):
+        post = self.create('#старый тег')
+        url = reverse('posts:tag_list', args=('старый',))
+        self.client.logout()
+        self.assertContains(self.client.get(url), 'старый тег')
+
+        post.text = '#новый тег'
+        post.save()
+        self.assertNotContains(self.client.get(url), 'новый тег')
+
+    def test_build_tags(self):
+        Post.objects.bulk_create([
+            Post(text='#импорт один', author=self.user),
+            Post(text='Без тегов', author=self.user),
+        ])
+
+        call_command('build_tags', stdout=StringIO())
+
+        tag = Tag.objects.get(name='импорт')
+        self.assertEqual(
+            list(tag.posts.values_list('text', flat=True)), ['#импорт один']
+        )
+
+
+@override_settings(AUTOCOMPLETE_REBUILD_INTERVAL=0)
+class AutocompleteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for username in ('Anna', 'anton', 'boris', 'annabel'):
+            User.objects.create(username=username)
+        Group.objects.create(title='Анималисты', slug='animals')
+
+    def setUp(self):
+        cache.clear()
+
+    def suggest(self, query):
+        response = self.client.get(reverse('posts:autocomplete'), {'q': query})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [
+            (result['type'], result['label'], result['url'])
+            for result in response.json()['results']
+        ]
+
+    def test_prefix_index(self):
+        index = PrefixIndex([('ab', 1), ('abc', 2), ('b', 3), ('aa', 4)])
+        self.assertEqual(index.search('ab', 10), [1, 2])
+        self.assertEqual(index.search('a', 2), [4, 1])
+        self.assertEqual(index.search('c', 10), [])
+
+    def test_suggests_groups_and_users(self):
+        self.assertEqual(self.suggest('AN'), [
+            ('group', 'Анималисты', '/group/animals/'),
+            ('user', 'Anna', '/profile/Anna/'),
+            ('user', 'annabel', '/profile/annabel/'),
+            ('user', 'anton', '/profile/anton/'),
+        ])
+        self.assertEqual(
+            self.suggest('ани'), [('group', 'Анималисты', '/group/animals/')]
+        )
+        self.assertEqual(self.suggest(' '), [])
+
+    def test_limit(self):
+        with self.settings(AUTOCOMPLETE_LIMIT=2):
+            self.assertEqual(len(self.suggest('a')), 2)
+
+    def test_groups_take_at_most_half(self):
+        for number in range(4):
+            Group.objects.create(title=f'Анна {number}', slug=f'anna-{number}')
+        with self.settings(AUTOCOMPLETE_LIMIT=4):
+            self.assertEqual(
+                [kind for kind, _, _ in self.suggest('ann')],
+                ['group', 'group', 'user', 'user'],
+            )
+            self.assertEqual(
+                [kind for kind, _, _ in self.suggest('анна')],
+                ['group'] * 4,
+            )
+
+    def test_index_is_built_once_per_version(self):
+        self.suggest('an')
+        with self.assertNumQueries(0):
+            self.suggest('bo')
+
+        User.objects.create(username='borislav')
+        self.assertEqual(
+            [label for _, label, _ in self.suggest('bor')],
+            ['boris', 'borislav'],
+        )
+
+    def test_signup_does_not_rebuild_in_request(self):
+        self.suggest('bo')
+        with self.settings(AUTOCOMPLETE_REBUILD_INTERVAL=30), mock.patch(
+            'posts.autocomplete._rebuild', None
+        ), mock.patch('posts.autocomplete.threading.Timer') as timer:
+            with run_on_commit_callbacks():
+                User.objects.create(username='borislav')
+            with self.assertNumQueries(0):
+                labels = [label for _, label, _ in self.suggest('bor')]
+        self.assertEqual(labels, ['boris', 'borislav'])
+        timer.assert_called_once()
+        timer.return_value.start.assert_called_once_with()
+
+    def test_index_expires_without_shared_cache(self):
+        self.suggest('bo')
+        # Пользователь из другого процесса: сброс ключа сюда не дошёл.
+        User.objects.bulk_create([User(username='borislav')])
+        with self.settings(AUTOCOMPLETE_MAX_AGE=None):
+            self.assertEqual(len(self.suggest('bor')), 1)
+        with self.settings(AUTOCOMPLETE_MAX_AGE=0):
+            self.assertEqual(len(self.suggest('bor')), 2)
+
+    def test_login_keeps_index(self):
+        user = User.objects.get(username='boris')
+        self.suggest('b')
+        self.client.force_login(user)
+        with self.assertNumQueries(0):
+            self.suggest('b')
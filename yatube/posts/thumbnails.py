@@ -0,0 +1,274 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from PIL import Image
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.models import KVStore
+
+from .caching import increment, purge_surrogate_keys
+from .models import Post
+from .uploads import image_placeholder
+
+logger = logging.getLogger(__name__)
+
+MISSES_KEY = 'thumbnails:misses'
+PENDING_KEY = 'thumbnails:pending:{}'
+PENDING_TTL = 60 * 5
+
+_pool = None
+
+
+def thumbnail_options(source, options):
+    """Опции миниатюры с умолчаниями sorl, как в get_thumbnail."""
+    options = dict(options)
+    backend = default.backend
+    if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in ThumbnailBackend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in ThumbnailBackend.extra_options:
+        value = getattr(thumbnail_settings, attr)
+        if value != getattr(default_settings, attr):
+            options.setdefault(key, value)
+    return options
+
+
+def supported_formats():
+    """Форматы из POST_THUMBNAIL_FORMATS, которые умеет писать Pillow."""
+    Image.init()
+    return [
+        image_format for image_format in settings.POST_THUMBNAIL_FORMATS
+        if image_format in Image.SAVE
+    ]
+
+
+def thumbnail_variants(geometry):
+    """
+    Варианты миниатюры geometry: (формат, ширина, геометрия, опции)
+    для каждого формата и ширины из POST_THUMBNAIL_WIDTHS.
+    """
+    geometry_string, options = settings.POST_THUMBNAILS[geometry]
+    width, height = map(int, geometry_string.split('x'))
+    widths = [
+        variant for variant in settings.POST_THUMBNAIL_WIDTHS
+        if variant < width
+    ] + [width]
+    for image_format in supported_formats():
+        for variant in widths:
+            yield (
+                image_format,
+                variant,
+                f'{variant}x{round(height * variant / width)}',
+                {**options, 'format': image_format},
+            )
+
+
+def source_file(image):
+    """
+    Картинка поста как источник sorl.
+
+    Хранилище входит в ключ миниатюры, поэтому и для имени файла
+    берётся хранилище поля Post.image.
+    """
+    return ImageFile(image, Post._meta.get_field('image').storage)
+
+
+def thumbnail_file(image, geometry_string, options):
+    """Файл миниатюры, которую sorl создал бы для image с этими опциями."""
+    source = source_file(image)
+    name = default.backend._get_thumbnail_filename(
+        source, geometry_string, thumbnail_options(source, options)
+    )
+    return ImageFile(name, default.storage)
+
+
+def cached_variants(image, geometry):
+    """
+    Готовые варианты миниатюры: {формат: [(ширина, файл), ...]}.
+
+    None, если хотя бы одного варианта ещё нет.
+    """
+    return prefetch_variants([image], geometry)[image.name]
+
+
+def _kvstore_get_many(image_files):
+    """
+    Записи kvstore sorl для image_files: один get_many к кэшу
+    и, для промахов, один запрос к базе.
+    """
+    kvstore = default.kvstore
+    kvstore_cache = getattr(kvstore, 'cache', None)
+    if kvstore_cache is None:
+        return [kvstore.get(image_file) for image_file in image_files]
+    keys = [add_prefix(image_file.key) for image_file in image_files]
+    values = kvstore_cache.get_many(keys)
+    missing = [key for key in keys if key not in values]
+    if missing:
+        found = dict(
+            KVStore.objects.filter(key__in=missing).values_list(
+                'key', 'value'
+            )
+        )
+        # Как и sorl, запоминаем в кэше и отсутствие записи.
+        fetched = {key: found.get(key, EMPTY_VALUE) for key in missing}
+        kvstore_cache.set_many(
+            fetched, thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT
+        )
+        values.update(fetched)
+    return [
+        None if values[key] == EMPTY_VALUE
+        else deserialize_image_file(values[key])
+        for key in keys
+    ]
+
+
+def prefetch_variants(images, geometry):
+    """
+    cached_variants для нескольких картинок разом: {имя: варианты}.
+
+    Все варианты всех картинок читаются из kvstore одним обращением.
+    """
+    images = [image for image in images if image]
+    variants = list(thumbnail_variants(geometry))
+    files = _kvstore_get_many([
+        thumbnail_file(image, geometry_string, options)
+        for image in images
+        for _, _, geometry_string, options in variants
+    ])
+    result = {}
+    for index, image in enumerate(images):
+        found = {}
+        row = files[index * len(variants):(index + 1) * len(variants)]
+        for (image_format, width, *_), thumbnail in zip(variants, row):
+            if thumbnail is None:
+                found = None
+                break
+            found.setdefault(image_format, []).append((width, thumbnail))
+        result[image.name] = found
+    return result
+
+
+def fill_placeholder(name):
+    """Заглушка для постов с картинкой name, у которых её ещё нет."""
+    posts = Post.objects.filter(image=name, placeholder='')
+    if not posts.exists():
+        return
+    storage = Post._meta.get_field('image').storage
+    with storage.open(name) as file:
+        placeholder = image_placeholder(Image.open(file))
+    posts.update(placeholder=placeholder)
+
+
+def generate_thumbnails(name):
+    """
+    Создаёт все варианты миниатюр POST_THUMBNAILS для файла name
+    и заглушку картинки.
+    """
+    fill_placeholder(name)
+    source = source_file(name)
+    for geometry in settings.POST_THUMBNAILS:
+        for *_, geometry_string, options in thumbnail_variants(geometry):
+            default.backend.get_thumbnail(source, geometry_string, **options)
+    return name
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # spawn, а не fork: дочерний процесс не делит с родителем
+        # соединения с базой и кэшем. Инициализатор — сам django.setup:
+        # модули проекта нельзя импортировать до него.
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.POST_THUMBNAIL_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup,
+        )
+    return _pool
+
+
+def _finish(name, keys):
+    """
+    Сбрасывает страницы с ключами keys, чтобы они отрисовались уже
+    с миниатюрой.
+
+    sorl запоминает в кэше и отсутствие миниатюры; если кэш не общий
+    с процессом пула, эту отметку нужно убрать здесь.
+    """
+    kvstore_cache = getattr(default.kvstore, 'cache', None)
+    if kvstore_cache is not None:
+        kvstore_cache.delete_many([
+            add_prefix(thumbnail_file(name, geometry_string, options).key)
+            for geometry in settings.POST_THUMBNAILS
+            for *_, geometry_string, options in thumbnail_variants(geometry)
+        ])
+    cache.delete(PENDING_KEY.format(name))
+    purge_surrogate_keys(*keys)
+
+
+def _done(name, keys, future):
+    if future.exception() is not None:
+        logger.error(
+            'Не удалось создать миниатюры для %s', name,
+            exc_info=future.exception(),
+        )
+        return
+    _finish(name, keys)
+
+
+def _submit(name, keys):
+    if not settings.POST_THUMBNAIL_WORKERS:
+        generate_thumbnails(name)
+        _finish(name, keys)
+        return
+    global _pool
+    try:
+        future = _get_pool().submit(generate_thumbnails, name)
+    except BrokenProcessPool:
+        # Упавший пул не должен ронять запрос: следующая задача
+        # создаст новый, а эта повторится при следующем промахе.
+        logger.exception('Пул миниатюр сломан, создаём заново')
+        _pool = None
+        cache.delete(PENDING_KEY.format(name))
+        return
+    future.add_done_callback(partial(_done, name, keys))
+
+
+def schedule_thumbnails(image, keys=()):
+    """
+    Ставит создание миниатюр в очередь пула после фиксации транзакции.
+
+    Повторный вызов для того же файла, пока первый не выполнен,
+    ничего не делает.
+    """
+    if not image:
+        return
+    if not cache.add(PENDING_KEY.format(image.name), True, PENDING_TTL):
+        return
+    transaction.on_commit(lambda: _submit(image.name, list(keys)))
+
+
+def record_miss(image):
+    """Учитывает отрисовку без готовой миниатюры."""
+    increment(MISSES_KEY)
+    logger.info('Нет готовой миниатюры для %s', image.name)
+
+
+def thumbnail_misses():
+    return cache.get(MISSES_KEY, 0)
+
+
+def reset_thumbnail_misses():
+    cache.delete(MISSES_KEY)
@@ -0,0 +1,226 @@
+import base64
+import io
+from functools import wraps
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.template.defaultfilters import filesizeformat
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from PIL import Image
+
+# Столько первых байт файла хватает, чтобы Pillow прочитал заголовок.
+HEADER_LIMIT = 64 * 1024
+JPEG_SOI = b'\xff\xd8'
+# Сегменты APPn (EXIF, ICC-профиль, XMP) и комментарии: для формата
+# и размеров они не нужны, а вместе бывают больше HEADER_LIMIT.
+JPEG_SKIPPED_MARKERS = frozenset(range(0xE0, 0xF0)) | {0xFE}
+# Заглушка картинки: сторона в пикселях и качество JPEG.
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 40
+
+
+class JpegHeaderFilter:
+    """
+    Пропускает сегменты APPn и COM в начале JPEG (после SOI) по их
+    длине, не держа их в памяти. Всё, что идёт после, отдаёт как есть.
+    """
+
+    def __init__(self):
+        self.pending = b''
+        self.skip = 0
+        self.done = False
+
+    def feed(self, data):
+        """Байты из data, которые нужны заголовку."""
+        if self.done:
+            return data
+        skipped = min(self.skip, len(data))
+        self.skip -= skipped
+        data = self.pending + data[skipped:]
+        self.pending = b''
+        position = 0
+        while len(data) - position >= 4:
+            if (
+                data[position] != 0xFF
+                or data[position + 1] not in JPEG_SKIPPED_MARKERS
+            ):
+                self.done = True
+                return data[position:]
+            length = int.from_bytes(data[position + 2:position + 4], 'big')
+            position += 2 + length
+            if position > len(data):
+                self.skip = position - len(data)
+                return b''
+        self.pending = data[position:]
+        return b''
+
+
+class BoundedImageUploadHandler(FileUploadHandler):
+    """
+    Проверяет картинку, пока она загружается, а не после.
+
+    Стоит первым в цепочке обработчиков и пропускает данные дальше.
+    Файл отбрасывается без дочитывания в память, как только он
+    превысил POST_IMAGE_MAX_BYTES, формат из заголовка не входит
+    в POST_IMAGE_FORMATS или картинка больше POST_IMAGE_MAX_PIXELS
+    (защита от «бомбы распаковки»). Причина попадает в errors.
+    """
+
+    def __init__(self, request=None, field_names=('image',)):
+        super().__init__(request)
+        self.field_names = field_names
+        self.errors = {}
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.active = field_name in self.field_names
+        self.header = b''
+        self.jpeg = None
+        self.checked = False
+        if self.active and (self.content_length or 0) > self.max_bytes:
+            self.reject(self.too_large_message())
+
+    @property
+    def max_bytes(self):
+        return settings.POST_IMAGE_MAX_BYTES
+
+    def too_large_message(self):
+        return (
+            'Файл больше '
+            f'{filesizeformat(self.max_bytes)}, загрузите картинку меньше.'
+        )
+
+    def reject(self, message):
+        self.errors[self.field_name] = message
+        raise SkipFile
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        if start + len(raw_data) > self.max_bytes:
+            self.reject(self.too_large_message())
+        if not self.checked:
+            self.add_header_bytes(raw_data)
+            self.check_header()
+        return raw_data
+
+    def add_header_bytes(self, data):
+        if self.jpeg is None:
+            data = self.header + data
+            if len(data) < len(JPEG_SOI):
+                self.header = data
+                return
+            self.header = b''
+            if data.startswith(JPEG_SOI):
+                self.jpeg = JpegHeaderFilter()
+                self.header, data = JPEG_SOI, data[len(JPEG_SOI):]
+            else:
+                self.jpeg = False
+        if self.jpeg:
+            data = self.jpeg.feed(data)
+        self.header += data[:HEADER_LIMIT - len(self.header)]
+
+    def check_header(self):
+        try:
+            image = Image.open(io.BytesIO(self.header))
+        except Image.DecompressionBombError:
+            self.reject(self.bomb_message())
+        except Exception:
+            # Заголовок ещё не дочитан; если он (без APPn у JPEG)
+            # длиннее HEADER_LIMIT, это не картинка из тех, что мы
+            # принимаем.
+            if len(self.header) >= HEADER_LIMIT:
+                self.reject('Не удалось прочитать заголовок картинки.')
+            return
+        self.checked = True
+        self.header = b''
+        if image.format not in settings.POST_IMAGE_FORMATS:
+            self.reject(
+                'Поддерживаются только форматы '
+                f'{", ".join(settings.POST_IMAGE_FORMATS)}.'
+            )
+        width, height = image.size
+        if width * height > settings.POST_IMAGE_MAX_PIXELS:
+            self.reject(self.bomb_message())
+
+    def bomb_message(self):
+        megapixels = settings.POST_IMAGE_MAX_PIXELS / 10 ** 6
+        return f'Картинка больше {megapixels:g} мегапикселей.'
+
+    def file_complete(self, file_size):
+        return None
+
+
+def image_placeholder(opened):
+    """
+    data:-адрес крошечной JPEG-копии картинки.
+
+    Несколько сотен байт встраиваются прямо в страницу и видны,
+    пока грузится настоящая картинка.
+    """
+    opened.draft('RGB', (PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    opened.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    buffer = io.BytesIO()
+    opened.convert('RGB').save(buffer, 'JPEG', quality=PLACEHOLDER_QUALITY)
+    return (
+        'data:image/jpeg;base64,'
+        + base64.b64encode(buffer.getvalue()).decode()
+    )
+
+
+def image_metadata(image, with_placeholder=True):
+    """
+    Ширина, высота, формат, размер файла и заглушка картинки
+    для полей Post.
+
+    Без with_placeholder читается только заголовок файла, а заглушка
+    остаётся пустой.
+    """
+    if not image:
+        return {
+            'width': None,
+            'height': None,
+            'format': '',
+            'bytes': None,
+            'placeholder': '',
+        }
+    image.open('rb')
+    try:
+        opened = Image.open(image)
+        width, height = opened.size
+        image_format = opened.format or ''
+        placeholder = image_placeholder(opened) if with_placeholder else ''
+    finally:
+        # Загруженный файл ещё будет сохранён в хранилище.
+        if isinstance(image, UploadedFile):
+            image.seek(0)
+        else:
+            image.close()
+    return {
+        'width': width,
+        'height': height,
+        'format': image_format,
+        'bytes': image.size,
+        'placeholder': placeholder,
+    }
+
+
+def bounded_image_uploads(view):
+    """
+    Подключает BoundedImageUploadHandler к представлению.
+
+    Обработчики нельзя менять после того, как CsrfViewMiddleware
+    прочитала request.POST, поэтому проверка CSRF переносится внутрь.
+    Ошибки загрузки лежат в request.upload_errors.
+    """
+    protected = csrf_protect(view)
+
+    @csrf_exempt
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        handler = BoundedImageUploadHandler(request)
+        request.upload_handlers.insert(0, handler)
+        request.upload_errors = handler.errors
+        return protected(request, *args, **kwargs)
+    return wrapper
@@ -1,64 +1,192 @@
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.db.models import OuterRef, Subquery
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 
-from yatube.settings import POSTS_QUANTITY
-
+from .autocomplete import suggest
+from .caching import (
+    add_surrogate_keys, cache_anonymous_page, conditional_page,
+    feed_cache_key, post_surrogate_keys, surrogate_key,
+)
+from .counters import stats_for
+from .feeds import following_feed
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post, User
+from .models import Comment, Follow, Group, Post, Tag, User
+from .paginators import latest_post_key, paginate
+from .search import fts_available, matching_posts, search_posts
+from .tags import TagSource
+from .thumbnails import schedule_thumbnails
+from .uploads import bounded_image_uploads
+
+
+def _index_validators(request):
+    return ['posts'], lambda: latest_post_key(Post.objects.all()) or ()
+
+
+def _group_validators(request, slug):
+    posts = Post.objects.filter(group__slug=slug)
+    return [surrogate_key('group', slug)], lambda: latest_post_key(posts) or ()
+
+
+def _tag_validators(request, name):
+    name = name.casefold()
+
+    def marks():
+        tag = Tag.objects.filter(name=name).first()
+        if tag is None:
+            return None
+        return latest_post_key(TagSource(tag)) or ()
+    return [surrogate_key('tag', name)], marks
+
 
+def _profile_validators(request, username):
+    keys = [surrogate_key('author', username)]
+    if request.user.is_authenticated:
+        keys.append(surrogate_key('follow', request.user.pk))
+    posts = Post.objects.filter(author__username=username)
+    return keys, lambda: latest_post_key(posts) or ()
 
+
+def _post_detail_validators(request, post_id):
+    last_comment = Comment.objects.filter(
+        post=OuterRef('pk')
+    ).order_by('-created').values('created')[:1]
+    post = Post.objects.filter(pk=post_id).annotate(
+        last_comment=Subquery(last_comment)
+    ).values_list('author__username', 'pub_date', 'last_comment').first()
+    if post is None:
+        return None
+    username, *marks = post
+    keys = [surrogate_key('post', post_id), surrogate_key('author', username)]
+    return keys, tuple(marks)
+
+
+def _follow_validators(request):
+    keys = ['posts', surrogate_key('follow', request.user.pk)]
+    return keys, lambda: latest_post_key(following_feed(request.user)) or ()
+
+
+@conditional_page(_index_validators)
+@cache_anonymous_page
 def index(request):
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, POSTS_QUANTITY)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginate(
+        request, Post.objects.select_related('author', 'group')
+    )
+    context = {
+        'page_obj': page_obj,
+        'feed_cache_timeout': settings.FEED_CACHE_TIMEOUT,
+        'feed_cache_key': feed_cache_key(request, 'posts'),
+    }
+    response = render(request, 'posts/index.html', context)
+    return add_surrogate_keys(response, 'posts')
+
+
+# Страничный кэш поиску не нужен: каждый ?q= стал бы отдельной
+# записью, и случайные запросы вытеснили бы из кэша ленты.
+@conditional_page(_index_validators)
+def search(request):
+    query = request.GET.get('q', '').strip()[
+        :settings.SEARCH_QUERY_MAX_LENGTH
+    ]
+    posts = Post.objects.select_related('author', 'group')
+    page_obj = None
+    if query and fts_available():
+        page_obj = search_posts(
+            posts, query, settings.POSTS_QUANTITY,
+            after=request.GET.get('after'),
+            before=request.GET.get('before'),
+        )
+    elif query:
+        found = matching_posts(posts, query)
+        if found is None:
+            found = posts.filter(text__icontains=query)
+        page_obj = paginate(request, found)
     context = {
+        'query': query,
         'page_obj': page_obj,
     }
-    return render(request, 'posts/index.html', context)
+    response = render(request, 'posts/search.html', context)
+    return add_surrogate_keys(response, 'posts')
+
 
+def autocomplete(request):
+    results = suggest(request.GET.get('q', ''), settings.AUTOCOMPLETE_LIMIT)
+    return JsonResponse({'results': results})
 
+
+@conditional_page(_group_validators)
+@cache_anonymous_page
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
-    paginator = Paginator(posts, POSTS_QUANTITY)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginate(
+        request, group.posts.select_related('author', 'group')
+    )
+    group_key = surrogate_key('group', group.slug)
     context = {
         'group': group,
         'page_obj': page_obj,
+        'feed_cache_timeout': settings.FEED_CACHE_TIMEOUT,
+        'feed_cache_key': feed_cache_key(request, group_key),
     }
-    return render(request, 'posts/group_list.html', context)
+    response = render(request, 'posts/group_list.html', context)
+    return add_surrogate_keys(response, group_key)
 
 
+@conditional_page(_tag_validators)
+@cache_anonymous_page
+def tag_posts(request, name):
+    tag = get_object_or_404(Tag, name=name.casefold())
+    page_obj = paginate(request, TagSource(tag))
+    tag_key = surrogate_key('tag', tag.name)
+    context = {
+        'tag': tag,
+        'page_obj': page_obj,
+        'feed_cache_timeout': settings.FEED_CACHE_TIMEOUT,
+        'feed_cache_key': feed_cache_key(request, tag_key),
+    }
+    response = render(request, 'posts/tag_list.html', context)
+    return add_surrogate_keys(response, tag_key)
+
+
+@conditional_page(_profile_validators)
+@cache_anonymous_page
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    posts = author.posts.all()
-    paginator = Paginator(posts, POSTS_QUANTITY)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    post_quantity = author.posts.count()
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
+    page_obj = paginate(
+        request, author.posts.select_related('author', 'group')
+    )
+    post_quantity = stats_for(author).posts_count
 
     following = (
         request.user.is_authenticated
         and request.user.follower.filter(author__username=username).exists()
     )
 
+    author_key = surrogate_key('author', author.username)
     context = {
         'author': author,
         'page_obj': page_obj,
         'post_quantity': post_quantity,
-        'following': following
+        'following': following,
+        'feed_cache_timeout': settings.FEED_CACHE_TIMEOUT,
+        'feed_cache_key': feed_cache_key(request, author_key),
     }
-    return render(request, 'posts/profile.html', context)
+    response = render(request, 'posts/profile.html', context)
+    return add_surrogate_keys(response, author_key)
 
 
+@conditional_page(_post_detail_validators)
+@cache_anonymous_page
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
-    post_quantity = post.author.posts.count()
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'), pk=post_id
+    )
+    post_quantity = stats_for(post.author).posts_count
     comment_form = CommentForm()
-    comments = post.comments.select_related('author')
+    comments = post.comments.select_related('author').order_by('created')
 
     context = {
         'post': post,
@@ -66,21 +194,33 @@ def post_detail(request, post_id):
         'comments': comments,
         'comment_form': comment_form
     }
-    return render(request, 'posts/post_detail.html', context)
+    response = render(request, 'posts/post_detail.html', context)
+    return add_surrogate_keys(
+        response,
+        surrogate_key('post', post.pk),
+        surrogate_key('author', post.author.username),
+    )
 
 
 @login_required
+@bounded_image_uploads
 def post_create(request):
-    form = PostForm(request.POST or None, files=request.FILES or None)
+    form = PostForm(
+        request.POST or None,
+        files=request.FILES or None,
+        upload_errors=request.upload_errors,
+    )
     if form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
         post.save()
+        schedule_thumbnails(post.image, post_surrogate_keys(post))
         return redirect(f'/profile/{request.user}/')
     return render(request, 'posts/create_post.html', {'form': form})
 
 
 @ login_required
+@bounded_image_uploads
 def post_edit(request, post_id: int):
     post = get_object_or_404(Post, id=post_id)
     if request.user != post.author:
@@ -88,9 +228,12 @@ def post_edit(request, post_id: int):
 
     form = PostForm(request.POST or None,
                     files=request.FILES or None,
-                    instance=post)
+                    instance=post,
+                    upload_errors=request.upload_errors)
     if form.is_valid():
-        form.save()
+        post = form.save()
+        if 'image' in form.changed_data:
+            schedule_thumbnails(post.image, post_surrogate_keys(post))
         return redirect('posts:post_detail', post_id)
 
     context = {
@@ -114,19 +257,17 @@ def add_comment(request, post_id):
 
 
 @ login_required
+@conditional_page(_follow_validators)
 def follow_index(request):
-    posts = Post.objects.select_related().filter(
-        author__following__user=request.user)
-
-    page_number = request.GET.get('page')
-
-    paginator = Paginator(posts, POSTS_QUANTITY)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginate(request, following_feed(request.user))
 
     template = 'posts/follow.html'
     context = {
         'page_obj': page_obj,
+        'feed_cache_timeout': settings.FEED_CACHE_TIMEOUT,
+        'feed_cache_key': feed_cache_key(
+            request, 'posts', surrogate_key('follow', request.user.pk)
+        ),
     }
 
     return render(request, template, context)
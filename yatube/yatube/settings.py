@@ -146,13 +146,88 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 POSTS_QUANTITY = 10
 
+# Посты авторов, у которых подписчиков больше порога, не раскладываются
+# по лентам при публикации, а дочитываются при показе ленты подписок.
+FEED_FAN_OUT_THRESHOLD = 10000
+# Новому подписчику раскладывается столько последних постов автора,
+# более старые видны в профиле.
+FEED_BACKFILL_POSTS = 500
+
+# Страницы для анонимов целиком лежат в кэше, пока не сброшены их
+# суррогатные ключи. YATUBE_PAGE_CACHE=0 отключает этот кэш.
+PAGE_CACHE_ENABLED = os.getenv('YATUBE_PAGE_CACHE', '1') != '0'
+
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
+# Поиск сортирует по релевантности только столько самых новых
+# совпадений: частое слово иначе заставило бы считать bm25
+# для сотен тысяч постов.
+SEARCH_RANK_LIMIT = 2000
+# Длиннее запрос поиска обрезается.
+SEARCH_QUERY_MAX_LENGTH = 200
+# 'fts5' или 'trigram'; по умолчанию FTS5, если база — SQLite с этим
+# модулем, иначе триграммный индекс (заполняется build_trigram_index).
+SEARCH_BACKEND = os.getenv('YATUBE_SEARCH_BACKEND') or None
+# Столько подсказок отдаёт /autocomplete/.
+AUTOCOMPLETE_LIMIT = 10
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+# Медиафайлы отдаёт core.media.serve_media. В продакшене передачу
+# файла лучше отдать фронт-серверу: 'nginx' отвечает заголовком
+# X-Accel-Redirect на internal location MEDIA_ACCEL_PREFIX,
+# 'sendfile' — заголовком X-Sendfile (Apache, lighttpd).
+MEDIA_SENDFILE = os.getenv('YATUBE_MEDIA_SENDFILE') or None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+# Имена картинок и миниатюр выводятся из содержимого и не меняются.
+MEDIA_CACHE_MAX_AGE = 60 * 60 * 24 * 365
+
+# Общий кэш всех процессов сайта: YATUBE_MEMCACHED=host:port[,host:port]
+# (нужен пакет python-memcached). Без него у каждого процесса свой
+# LocMemCache, и сброс суррогатного ключа видит только процесс, который
+# его сделал: остальные отдают старое, пока не истечёт срок записи.
+# Поэтому без общего кэша все сроки ниже — минута.
+MEMCACHED_LOCATION = os.getenv('YATUBE_MEMCACHED')
+CACHE_SHARED = bool(MEMCACHED_LOCATION)
+if CACHE_SHARED:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': MEMCACHED_LOCATION.split(','),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
     }
+# Фрагменты лент ({% cache %}) и страницы для анонимов.
+FEED_CACHE_TIMEOUT = 60 * 60 * 24 if CACHE_SHARED else 60
+PAGE_CACHE_TIMEOUT = 60 * 10 if CACHE_SHARED else 60
+# Индекс подсказок процесс перестраивает по сбросу AUTOCOMPLETE_KEY,
+# а без общего кэша ещё и не реже, чем раз в столько секунд.
+AUTOCOMPLETE_MAX_AGE = None if CACHE_SHARED else 60
+# Перестройка индекса подсказок идёт в фоне и не чаще раза в столько
+# секунд; 0 — сразу, в самом запросе.
+AUTOCOMPLETE_REBUILD_INTERVAL = 30
+
+# Размеры миниатюр постов: создаются заранее в пуле процессов после
+# загрузки картинки, шаблоны только читают готовые.
+POST_THUMBNAILS = {
+    'card': ('960x339', {'crop': 'center', 'upscale': True}),
 }
+# Каждая миниатюра создаётся ещё и в меньших ширинах и во всех
+# форматах, которые умеет писать Pillow; последний формат — запасной
+# для <img>, остальные уходят в <source> элемента <picture>.
+POST_THUMBNAIL_WIDTHS = (480, 720)
+POST_THUMBNAIL_FORMATS = ('WEBP', 'JPEG')
+POST_IMAGE_SIZES = '(min-width: 1200px) 960px, 100vw'
+POST_THUMBNAIL_WORKERS = 2
+
+# Ограничения на картинку поста проверяются прямо во время загрузки:
+# размер файла, формат по заголовку и число пикселей.
+POST_IMAGE_MAX_BYTES = 5 * 1024 * 1024
+POST_IMAGE_MAX_PIXELS = 25 * 10 ** 6
+POST_IMAGE_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')